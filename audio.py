@@ -0,0 +1,326 @@
+from collections import deque
+from multiprocessing import Process, Queue
+from queue import Full
+import random
+import threading
+import time
+import wave
+
+import numpy as np
+
+import config
+from metrics import Metrics
+import utils
+
+
+class Mixer:
+    """
+    Timeline of scheduled voices (int16 waveforms placed at absolute sample offsets), mixed down into fixed-size
+    blocks on demand. Only voices overlapping the current block are touched, so the cost of a block is bounded by
+    the number of sounding voices rather than the length of the timeline.
+    """
+
+    def __init__(self, block_size=int(config.block_duration * config.sample_rate)):
+        self.block_size = block_size
+        self.position = 0  # sample offset of the next block to be rendered
+        self.voices = []  # (start, waveform) pairs, not yet fully rendered
+
+    def add(self, waveform, start):
+        """
+        Schedule a waveform to start at an absolute sample offset.
+        """
+        self.voices.append((max(start, self.position), waveform))
+
+    def render_block(self):
+        """
+        Mix all voices overlapping the next block into an int16 buffer, then advance the timeline.
+        """
+        block = np.zeros(self.block_size, dtype=np.int32)
+        block_end = self.position + self.block_size
+        remaining = []
+        for start, waveform in self.voices:
+            end = start + len(waveform)
+            if start < block_end:
+                lo = max(start, self.position)
+                hi = min(end, block_end)
+                block[lo - self.position:hi - self.position] += waveform[lo - start:hi - start]
+            if end > block_end:
+                remaining.append((start, waveform))
+        self.voices = remaining
+        self.position = block_end
+        return np.clip(block, -2**15, 2**15 - 1).astype(np.int16)
+
+
+def prepare_chord(frequencies, rng=random):
+    """
+    Render everything one node contributes to the mix: its base chord, plus its supplemental note line as one
+    buffer starting with the chord.
+    """
+    return utils.generate_chord_wave(frequencies), utils.render_supplement(frequencies, rng=rng)
+
+
+def chord_nbytes(chord):
+    """
+    Memory held by a prepared chord's buffers.
+    """
+    base, supplement = chord
+    return base.nbytes + supplement.nbytes
+
+
+def schedule_chord(mixer, chord, start):
+    """
+    Place a prepared chord (base chord and supplemental note line) on the mixer timeline, starting at a sample
+    offset. Returns the offset at which the following chord should begin.
+    """
+    base, supplement = chord
+    mixer.add(base, start)
+    mixer.add(supplement, start)
+
+    # Next chord begins as this one fades out
+    return start + len(base) - int(config.crossfade * config.sample_rate)
+
+
+class Lookahead:
+    """
+    Background renderer for upcoming chords. Takes node indices from the queue and prepares their buffers while the
+    current chord plays, holding at most depth chords (rendered, or being rendered) and max_bytes of audio. A depth
+    below 1 is treated as 1, since the chord being rendered counts. The mixer then only has to pick up a finished
+    chord at each transition. If rendering fails, the error is raised from get.
+    """
+
+    def __init__(self, G, node_queue, metrics, depth=config.lookahead_depth, max_bytes=config.lookahead_bytes):
+        self.metrics = metrics
+        self.depth = max(depth, 1)  # the chord being rendered takes a slot, so 0 would never take a node
+        self.max_bytes = max_bytes
+        self.ready = deque()  # prepared chords, None once the queue is closed
+        self.nbytes = 0
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, args=(G, node_queue), daemon=True)
+        self.thread.start()
+
+    def has_room(self, nbytes):
+        return not self.ready or self.nbytes + nbytes <= self.max_bytes
+
+    def run(self, G, node_queue):
+        """
+        Render loop; a None node is passed through to the mixer and ends the loop, as does a rendering error, which is
+        passed on in place of the chord.
+        """
+        while True:
+            # Only take a node once there is room for it, counting the chord about to be rendered
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.ready) < self.depth)
+            node = node_queue.get()
+            chord = None
+            nbytes = 0
+            if node is not None:
+                try:
+                    start = time.perf_counter()
+                    chord = prepare_chord(G.node_frequencies(node))
+                    elapsed = time.perf_counter() - start
+                    self.metrics.record("synthesis", elapsed)
+                    self.metrics.record("synthesis_ratio", elapsed * config.sample_rate / len(chord[0]))
+                    nbytes = chord_nbytes(chord)
+                except Exception as e:
+                    chord = e
+            with self.condition:
+                self.condition.wait_for(lambda: self.has_room(nbytes))
+                self.ready.append(chord)
+                self.nbytes += nbytes
+                self.condition.notify_all()
+            if chord is None or isinstance(chord, Exception):
+                return
+
+    def get(self):
+        """
+        Next prepared chord, waiting for it if rendering has fallen behind. None means no more chords. Re-raises an
+        error from the render thread.
+        """
+        start = time.perf_counter()
+        with self.condition:
+            if not self.ready:
+                self.metrics.increment("lookahead_misses")
+            self.condition.wait_for(lambda: self.ready)
+            chord = self.ready.popleft()
+            if isinstance(chord, Exception):
+                raise chord
+            if chord is not None:
+                self.nbytes -= chord_nbytes(chord)
+            self.condition.notify_all()
+        self.metrics.record("chord_wait", time.perf_counter() - start)
+        return chord
+
+
+def stream_worker(G, node_queue):
+    """
+    Play the mix for the lifetime of the program. Upcoming chords are rendered ahead by a Lookahead thread; the mixer
+    takes one only when the timeline needs more material, and mixes the next block while the current one plays. A
+    None node drains the timeline and shuts the worker down.
+
+    simpleaudio has no streaming output, so each block is its own play_buffer call and the device is reopened at
+    every block boundary. Blocks are therefore one chord long (config.duration), as the chords were originally
+    played, to keep those gaps as rare as before.
+
+    Instrumented with a Metrics instance: synthesis time (absolute and relative to audio length), wait for the next
+    chord, block mix time, time to first sample, output underruns and drift of the wall clock against samples played
+    (the accumulated gaps between blocks).
+    """
+    import simpleaudio as sa  # only live playback needs an audio device
+
+    metrics = Metrics()
+    worker_start = time.perf_counter()
+    first_sample = None
+    lookahead = Lookahead(G, node_queue, metrics)
+    mixer = Mixer(block_size=int(config.duration * config.sample_rate))
+    next_start = 0
+    chords_played = 0
+    draining = False
+    play_obj = None
+    while True:
+
+        # Keep at least one block's worth of chords scheduled ahead of the mix position
+        while not draining and next_start < mixer.position + mixer.block_size:
+            chord = lookahead.get()
+            if chord is None:
+                draining = True
+                break
+            next_start = schedule_chord(mixer, chord, next_start)
+            chords_played += 1
+            metrics.increment("chords")
+            if chords_played % config.cache_report_interval == 0:
+                utils.log_wave_cache_stats()
+        if draining and not mixer.voices:
+            break
+
+        # Render the next block while the previous one is still playing
+        with metrics.timer("block_mix"):
+            block = mixer.render_block()
+        if play_obj is not None:
+            if not play_obj.is_playing():
+                metrics.increment("underruns")
+            play_obj.wait_done()
+        play_obj = sa.play_buffer(block, 1, 2, config.sample_rate)
+
+        # Output timing
+        now = time.perf_counter()
+        if first_sample is None:
+            first_sample = now
+            metrics.set("time_to_first_sample", now - worker_start)
+        samples_started = mixer.position - mixer.block_size
+        metrics.set("clock_drift", now - first_sample - samples_started / config.sample_rate)
+        metrics.maybe_report()
+
+    if play_obj is not None:
+        play_obj.wait_done()
+    metrics.report()
+
+
+class AudioEngine:
+    """
+    Single long-lived audio worker fed node indices over a queue. The graph is shipped to the worker once at startup.
+    The worker holds config.lookahead_depth (at least 1) upcoming chords and the queue one more node, so the caller's
+    walk runs at most lookahead_depth + 1 chords ahead of the one playing and is otherwise paced by the audio clock.
+    """
+
+    def __init__(self, G):
+        self.node_queue = Queue(maxsize=1)
+        self.worker = Process(target=stream_worker, args=(G, self.node_queue), daemon=True)
+        self.worker.start()
+
+    def play(self, node):
+        """
+        Queue a node for playback, blocking until the mixer has room for it. Raises RuntimeError if the worker has
+        died, rather than waiting forever.
+        """
+        while True:
+            try:
+                self.node_queue.put(node, timeout=1)
+                return
+            except Full:
+                if not self.worker.is_alive():
+                    raise RuntimeError(f"Audio worker exited with code {self.worker.exitcode}")
+
+    def close(self):
+        """
+        Let the worker finish what is scheduled, then wait for it.
+        """
+        if self.worker.is_alive():
+            self.play(None)
+        self.worker.join()
+
+
+class Walker:
+    """
+    One independent soundscape: a random walk over the chord graph feeding its own mixer, with its own random
+    generator. Produces the mix one block at a time on the sample clock, so it can run headless at any speed. Steps
+    are taken by the given transition model (see transitions.py), by default the graph's uniform step.
+    """
+
+    def __init__(self, G, start_node, rng=random, max_chords=None, transitions=None):
+        self.G = G
+        self.transitions = transitions or G
+        self.node = start_node
+        self.rng = rng
+        self.max_chords = max_chords
+        self.mixer = Mixer()
+        self.next_start = 0
+        self.chords_scheduled = 0
+
+    def next_block(self):
+        """
+        Mix the next block, or return None once max_chords chords have been played out.
+        """
+        # Keep the timeline one block ahead, following the same edge walk as live playback
+        while (self.max_chords is None or self.chords_scheduled < self.max_chords) \
+                and self.next_start < self.mixer.position + self.mixer.block_size:
+            chord = prepare_chord(self.G.node_frequencies(self.node), rng=self.rng)
+            self.next_start = schedule_chord(self.mixer, chord, self.next_start)
+            self.node = self.transitions.step(self.node, rng=self.rng)
+            self.chords_scheduled += 1
+        if self.max_chords is not None and self.chords_scheduled >= self.max_chords and not self.mixer.voices:
+            return None
+        return self.mixer.render_block()
+
+
+def render_to_file(G, start_node, path, num_chords=None, minutes=None, rng=random, transitions=None):
+    """
+    Walk the chord graph headlessly and write the mix to a file, block by block, as fast as synthesis allows. Writes
+    a 16-bit mono WAV file, or raw PCM if the path ends in .pcm or .raw. Stops after num_chords chords have sounded
+    or after the given number of minutes, whichever is set (and whichever comes first if both are). Memory use is
+    bounded by the mixer and waveform cache, independent of output length.
+    """
+    if num_chords is None and minutes is None:
+        raise ValueError("Either num_chords or minutes must be provided")
+    max_samples = int(minutes * 60 * config.sample_rate) if minutes is not None else None
+
+    # Open the output sink
+    raw = path.endswith((".pcm", ".raw"))
+    if raw:
+        sink = open(path, "wb")
+    else:
+        sink = wave.open(path, "wb")
+        sink.setnchannels(1)
+        sink.setsampwidth(2)
+        sink.setframerate(config.sample_rate)
+    write = sink.write if raw else sink.writeframes
+
+    utils.logger.info(f"Rendering to {path}...")
+    walker = Walker(G, start_node, rng=rng, max_chords=num_chords, transitions=transitions)
+    samples_written = 0
+    try:
+        while max_samples is None or samples_written < max_samples:
+            block = walker.next_block()
+            if block is None:
+                break
+            if max_samples is not None:
+                block = block[:max_samples - samples_written]
+            write(block.tobytes())
+            samples_written += len(block)
+    finally:
+        sink.close()
+
+    utils.logger.info(
+        f"Rendered {path}: wrote {samples_written / config.sample_rate:.1f}s of audio from "
+        f"{walker.chords_scheduled} chords"
+    )
+    return samples_written
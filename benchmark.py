@@ -0,0 +1,229 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import chord_graph
+import config
+import transitions
+import utils
+from trinity_visualization import trinity_config, trinity_utils
+
+
+# Chord vocabularies for the scaling sweep: (name, chord types, lower octave, upper octave)
+all_intervals = {
+    **config.intervals,
+    "dominant_seventh": [0, 4, 7, 10],
+    "diminished": [0, 3, 6],
+    "augmented": [0, 4, 8],
+}
+vocabularies = [
+    ("triads", ["major", "minor"], 3, 4),
+    ("default", list(config.intervals), config.lower_octave, config.upper_octave),
+    ("all_types", list(all_intervals), 3, 5),
+    ("all_types_wide", list(all_intervals), 1, 8),
+]
+# Import-time budgets (seconds, in a fresh interpreter) for each entry point's modules
+import_budgets = {
+    "config": .05,
+    "chord_graph": .5,  # graph building / cache loading
+    "audio": .5,  # live playback and headless rendering
+    "server": .5,
+    "trinity_visualization.trinity_utils": .5,  # JSON export; plotting and embedding libraries load on use
+}
+durations = [1, 4, 8, 16]  # seconds, for chord synthesis
+walk_steps = 100000
+smacof_limit = 1000  # chords above which the (slow) smacof embedding is skipped
+
+
+def measure(stage, params, func, repeat=1, per=1, trace_memory=True):
+    """
+    Time a stage (best of repeat runs, divided by per for per-operation figures) and record its peak traced memory.
+    Memory tracing slows down allocation-heavy Python code, so it is done in a separate run from the timing runs.
+    Returns the result entry and the last return value of func.
+    """
+    peak = None
+    if trace_memory:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func()
+        timings.append(time.perf_counter() - start)
+    entry = {"stage": stage, "params": params, "seconds": min(timings) / per, "peak_bytes": peak}
+    memory = f", {peak / 2**20:.1f} MiB peak" if peak is not None else ""
+    utils.logger.info(f"{stage} {params}: {entry['seconds'] * 1000:.4g} ms{memory}")
+    return entry, value
+
+
+def use_vocabulary(chord_types, lower_octave, upper_octave):
+    """
+    Point the config at a chord vocabulary.
+    """
+    config.intervals = {chord_type: all_intervals[chord_type] for chord_type in chord_types}
+    config.lower_octave = lower_octave
+    config.upper_octave = upper_octave
+
+
+def benchmark_imports(repeat):
+    """
+    Import time of each entry point's modules in a fresh interpreter, checked against its budget.
+    """
+    results = []
+    for module, budget in import_budgets.items():
+        code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+        timings = [
+            float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__))).stdout)
+            for _ in range(repeat)
+        ]
+        entry = {"stage": "import", "params": {"module": module}, "seconds": min(timings), "peak_bytes": None,
+                 "budget": budget, "within_budget": min(timings) <= budget}
+        log = utils.logger.info if entry["within_budget"] else utils.logger.warning
+        log(f"import {module}: {entry['seconds'] * 1000:.1f} ms (budget {budget * 1000:.0f} ms)")
+        results.append(entry)
+    return results
+
+
+def benchmark_synthesis(repeat):
+    """
+    Chord synthesis across durations and chord sizes, with the waveform cache cleared so every call synthesizes.
+    """
+    results = []
+    for duration in durations:
+        t = np.linspace(0, duration, int(config.sample_rate * duration), False)
+        for size in (1, 3, 4):
+            frequencies = [130.81 * 2 ** (i / 4) for i in range(size)]
+
+            def synthesize():
+                utils.wave_cache.clear()
+                utils.wave_cache_stats["bytes"] = 0
+                return utils.generate_chord_wave(frequencies, t=t)
+            entry, _ = measure("generate_chord_wave", {"duration": duration, "notes": size}, synthesize, repeat)
+            results.append(entry)
+    return results
+
+
+def benchmark_vocabulary(name, chord_types, lower_octave, upper_octave, repeat, output_dir):
+    """
+    Graph build, walk and visualization pipeline stages for one chord vocabulary.
+    """
+    use_vocabulary(chord_types, lower_octave, upper_octave)
+    results = []
+
+    # Chords and graph
+    entry, chords = measure("get_chords", {"vocabulary": name}, utils.get_chords, repeat)
+    params = {"vocabulary": name, "chords": sum(len(chord_list) for chord_list in chords.values())}
+    entry["params"] = params
+    results.append(entry)
+    entry, G = measure("generate_graph", {"vocabulary": name}, lambda: utils.generate_graph(chords), repeat)
+    # The graph has one node per chord name, so graph stages are labelled with its size rather than the voicings
+    graph_params = {"vocabulary": name, "nodes": G.number_of_nodes(), "edges": G.number_of_edges()}
+    entry["params"] = graph_params
+    results.append(entry)
+    entry, graph = measure(
+        "ChordGraph.from_networkx", graph_params, lambda: chord_graph.ChordGraph.from_networkx(G), repeat
+    )
+    results.append(entry)
+
+    # Walk steps, reported per step
+    def walk():
+        node = 0
+        for _ in range(walk_steps):
+            node = graph.step(node)
+    entry, _ = measure("walk_step", graph_params, walk, repeat, per=walk_steps, trace_memory=False)
+    results.append(entry)
+    entry, model = measure(
+        "TransitionModel.from_graph", graph_params, lambda: transitions.TransitionModel.from_graph(graph), repeat
+    )
+    results.append(entry)
+    entry, _ = measure("weighted_walk_step", graph_params, lambda: model.walk(0, walk_steps), repeat, per=walk_steps,
+                       trace_memory=False)
+    results.append(entry)
+
+    # Visualization pipeline: distances, embedding, Trinity export
+    enumerated_chords = [chord for chord_list in chords.values() for chord in chord_list]
+    entry, features = measure("chord_features", params, lambda: trinity_utils.chord_features(enumerated_chords), repeat)
+    results.append(entry)
+    entry, _ = measure("pairwise_distances", params, lambda: trinity_utils.pairwise_distances(features), repeat)
+    results.append(entry)
+    for method in ("classical", "landmark", "smacof"):
+        if method == "smacof" and len(enumerated_chords) > smacof_limit:
+            continue
+        entry, _ = measure("embed", {**params, "method": method}, lambda: trinity_utils.embed(features, method), repeat)
+        results.append(entry)
+    entry, (chords_with_vectors, _) = measure(
+        "generate_vector_space", params, lambda: trinity_utils.generate_vector_space(chords), repeat
+    )
+    results.append(entry)
+    path = os.path.join(output_dir, "trinity_graph.json")
+    entry, _ = measure(
+        "generate_trinity_graph", params,
+        lambda: trinity_utils.generate_trinity_graph(chords_with_vectors, save_graph=path), repeat
+    )
+    results.append(entry)
+    return results
+
+
+def compare(results, baseline_file):
+    """
+    Log the time ratio of each stage against a previous results file (above 1 means slower now).
+    """
+    with open(baseline_file) as f:
+        baseline = {(entry["stage"], json.dumps(entry["params"], sort_keys=True)): entry
+                    for entry in json.load(f)["results"]}
+    for entry in results:
+        previous = baseline.get((entry["stage"], json.dumps(entry["params"], sort_keys=True)))
+        if previous and previous["seconds"]:
+            utils.logger.info(f"{entry['stage']} {entry['params']}: {entry['seconds'] / previous['seconds']:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time and memory-profile the main pipeline stages.")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write results (JSON)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage; the fastest is reported")
+    parser.add_argument("--vocabularies", nargs="+", choices=[v[0] for v in vocabularies],
+                        default=[v[0] for v in vocabularies], help="chord vocabularies to sweep")
+    parser.add_argument("--compare", metavar="FILE", help="previous results file to compare against")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Fixed seeds, and no on-disk caches, so runs are reproducible and comparable
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    trinity_config.embedding_cache_dir = None
+
+    results = benchmark_imports(args.repeat)
+    results += benchmark_synthesis(args.repeat)
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name, chord_types, lower_octave, upper_octave in vocabularies:
+            if name in args.vocabularies:
+                results += benchmark_vocabulary(name, chord_types, lower_octave, upper_octave, args.repeat, output_dir)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    utils.logger.info(f"Saved benchmark results to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
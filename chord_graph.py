@@ -0,0 +1,385 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import random
+
+import numpy as np
+
+import config
+import parallel
+import pitches
+import utils
+
+
+# Bump whenever the layout of the binary cache changes
+CACHE_VERSION = 3
+
+
+class ChordGraph:
+    """
+    Compact, read-only chord graph for the playback walk. Neighbors are stored in CSR form (indptr/indices) and
+    per-node frequencies and note numbers in padded NumPy tables, so a walk step is O(1) without building edge
+    lists, and the whole graph pickles as a handful of flat arrays.
+    """
+
+    def __init__(self, node_ids, chord_names, notes, frequencies, note_counts, indptr, indices):
+        self.node_ids = node_ids  # original graph node labels, e.g. chord_0
+        self.chord_names = chord_names
+        self.notes = notes  # (nodes, max notes) note numbers, -1 padded
+        self.frequencies = frequencies  # (nodes, max notes), 0 padded
+        self.note_counts = note_counts
+        self.indptr = indptr
+        self.indices = indices
+
+    @classmethod
+    def from_networkx(cls, G):
+        """
+        Build a compact graph from the output of utils.generate_graph. Node i corresponds to list(G.nodes())[i].
+        """
+        node_ids = list(G.nodes())
+        position = {node: i for i, node in enumerate(node_ids)}
+
+        # Per-node note/frequency tables
+        notes, note_counts = pitches.pad([G.nodes[node]["notes"] for node in node_ids])
+        frequencies = np.zeros(notes.shape)
+        for i, node in enumerate(node_ids):
+            frequencies[i, :note_counts[i]] = G.nodes[node]["frequencies"]
+
+        # Adjacency in CSR form, keeping networkx neighbor order
+        degrees = np.array([G.degree(node) for node in node_ids], dtype=np.int64)
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        np.cumsum(degrees, out=indptr[1:])
+        indices = np.fromiter(
+            (position[neighbor] for node in node_ids for neighbor in G.adj[node]), dtype=np.int32, count=indptr[-1]
+        )
+        return cls(
+            node_ids, [G.nodes[node]["chord"] for node in node_ids], notes, frequencies, note_counts, indptr, indices
+        )
+
+    @classmethod
+    def from_edges(cls, node_ids, chord_names, node_notes, edges):
+        """
+        Build a compact graph from per-node note lists and (i, j) edge index pairs, with neighbors in ascending
+        order as in utils.generate_graph.
+        """
+        notes, note_counts = pitches.pad(node_notes)
+        frequencies = np.where(notes >= 0, pitches.frequencies(notes), 0)
+
+        # Adjacency in CSR form: both directions of every edge, sorted by (node, neighbor)
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        sources = np.concatenate([edges[:, 0], edges[:, 1]])
+        targets = np.concatenate([edges[:, 1], edges[:, 0]])
+        order = np.lexsort((targets, sources))
+        indptr = np.zeros(len(node_notes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(node_notes)), out=indptr[1:])
+        indices = targets[order].astype(np.int32)
+        return cls(node_ids, chord_names, notes, frequencies, note_counts, indptr, indices)
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def neighbors(self, node):
+        """
+        Neighbor indices of a node, as a view into the adjacency array.
+        """
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def step(self, node, rng=random):
+        """
+        Take one step of the random walk: move to a uniformly chosen neighbor of the current node. A node without
+        neighbors is repeated.
+        """
+        start = self.indptr[node]
+        degree = self.indptr[node + 1] - start
+        if not degree:
+            return node
+        return int(self.indices[start + int(rng.random() * degree)])
+
+    def node_frequencies(self, node):
+        """
+        Frequencies of a node's notes, as a view into the frequency table.
+        """
+        return self.frequencies[node, :self.note_counts[node]]
+
+    def node_notes(self, node):
+        """
+        Note numbers of a node, e.g. [52 55 60] (E3 G3 C4).
+        """
+        return self.notes[node, :self.note_counts[node]].tolist()
+
+
+class LazyChordGraph:
+    """
+    On-demand counterpart of ChordGraph for large chord vocabularies. Node i is the i-th chord name in get_chords
+    order (voiced as in generate_graph), but its notes, frequencies and neighbors are only computed on first visit
+    and memoized in a bounded LRU cache. Up front it only keeps one pitch class bitmask per node, so startup is
+    immediate and memory grows with the visited neighborhood rather than the vocabulary.
+    """
+
+    def __init__(self, cache_size=config.lazy_graph_cache_size):
+        self.chord_types = list(config.intervals.items())
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # node: (notes, frequencies, neighbors)
+
+        # Pitch class bitmask of every node, and nodes by bitmask, to find neighbors without building chords
+        self.masks = [
+            pitches.pitch_class_mask([root + interval for interval in interval_pattern])
+            for root in range(len(config.notes)) for _, interval_pattern in self.chord_types
+        ]
+        self.nodes_by_mask = parallel.mask_index(self.masks)
+
+    def __len__(self):
+        return len(self.masks)
+
+    def visit(self, node):
+        """
+        Notes, frequencies and neighbors of a node, computed on first visit.
+        """
+        entry = self.cache.get(node)
+        if entry is not None:
+            self.cache.move_to_end(node)
+            return entry
+
+        # Voice the chord as generate_graph does: its last inversion, in the last octave
+        root, chord_type = divmod(node, len(self.chord_types))
+        interval_pattern = self.chord_types[chord_type][1]
+        chord = [(root + interval) % 12 for interval in interval_pattern]
+        notes = utils.voice_chord(utils.get_inversions(chord)[-1], config.upper_octave - 1)
+        frequencies = pitches.frequencies(notes)
+
+        # Neighbors: chords whose pitch class set is this one with a single note added or removed
+        neighbors = sorted(parallel.mask_neighbors(self.nodes_by_mask, self.masks[node]))
+
+        entry = (notes, frequencies, np.array(neighbors, dtype=np.int32))
+        self.cache[node] = entry
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return entry
+
+    def neighbors(self, node):
+        return self.visit(node)[2]
+
+    def step(self, node, rng=random):
+        """
+        Take one step of the random walk: move to a uniformly chosen neighbor of the current node. A node without
+        neighbors is repeated.
+        """
+        neighbors = self.visit(node)[2]
+        if not len(neighbors):
+            return node
+        return int(neighbors[int(rng.random() * len(neighbors))])
+
+    def node_frequencies(self, node):
+        return self.visit(node)[1]
+
+    def node_notes(self, node):
+        return self.visit(node)[0]
+
+
+def cache_settings():
+    """
+    The settings a cached chord set and graph depend on.
+    """
+    return {
+        "version": CACHE_VERSION,
+        "notes": config.notes,
+        "intervals": list(config.intervals.items()),  # order matters, it determines node labels
+        "lower_octave": config.lower_octave,
+        "upper_octave": config.upper_octave,
+        "A4_freq": config.A4_freq,
+    }
+
+
+def config_hash(settings=None):
+    """
+    Fingerprint of the cache settings (the current config's by default).
+    """
+    return hashlib.sha256(json.dumps(settings or cache_settings()).encode()).hexdigest()
+
+
+def save_cache(chords, graph, path=config.cache_dir):
+    """
+    Save chords and a compact graph as a directory of .npy arrays plus a small JSON header. The header is written
+    last, so an interrupted save is never mistaken for a valid cache. Existing files are replaced rather than
+    overwritten, which lets a cache be rewritten in place while it is memory-mapped.
+    """
+    utils.logger.info(f"Saving chords/graph cache to {path}...")
+    os.makedirs(path, exist_ok=True)
+
+    # Chord tables: note numbers and chord type per chord
+    chord_names = list(chords)
+    flat = [(c, chord) for c, chord_name in enumerate(chord_names) for chord in chords[chord_name]]
+    chord_notes, chord_note_counts = pitches.pad([chord for _, chord in flat])
+    arrays = {
+        "chord_notes": chord_notes,
+        "chord_note_counts": chord_note_counts,
+        "chord_types": np.array([c for c, _ in flat], dtype=np.int32),
+        "node_notes": graph.notes,
+        "node_note_counts": graph.note_counts,
+        "node_frequencies": graph.frequencies,
+        "indptr": graph.indptr,
+        "indices": graph.indices,
+    }
+    for name, array in arrays.items():
+        # Write to a new file and swap it in, so arrays memory-mapped from an earlier load stay valid
+        target = os.path.join(path, f"{name}.npy")
+        with open(f"{target}.tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(f"{target}.tmp", target)
+
+    # Header, validated on load
+    header = {
+        "version": CACHE_VERSION,
+        "config_hash": config_hash(),
+        "settings": cache_settings(),
+        "chord_names": chord_names,
+        "node_ids": graph.node_ids,
+        "node_chord_names": graph.chord_names,
+    }
+    with open(os.path.join(path, "header.json"), "w") as f:
+        json.dump(header, f)
+
+
+def read_cache(path=config.cache_dir):
+    """
+    Read a cache directory without checking it against the current config: returns its header, chords dictionary
+    ({chord name: [[notes], ...]}) and compact graph. Raises ValueError if it was written by another cache version,
+    OSError if it is missing.
+    """
+    with open(os.path.join(path, "header.json")) as f:
+        header = json.load(f)
+    if header.get("version") != CACHE_VERSION:
+        raise ValueError(f"cache version {header.get('version')} is not {CACHE_VERSION}")
+    arrays = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        for name in ("chord_notes", "chord_note_counts", "chord_types", "node_notes", "node_note_counts",
+                     "node_frequencies", "indptr", "indices")
+    }
+
+    # Rebuild the chords dictionary from the chord tables
+    chords = {chord_name: [] for chord_name in header["chord_names"]}
+    for notes, count, c in zip(arrays["chord_notes"].tolist(), arrays["chord_note_counts"].tolist(),
+                               arrays["chord_types"].tolist()):
+        chords[header["chord_names"][c]].append(notes[:count])
+
+    graph = ChordGraph(
+        header["node_ids"], header["node_chord_names"], arrays["node_notes"], arrays["node_frequencies"],
+        arrays["node_note_counts"], arrays["indptr"], arrays["indices"]
+    )
+    return header, chords, graph
+
+
+def load_cache(path=config.cache_dir):
+    """
+    Load chords and a compact graph saved by save_cache, memory-mapping the arrays. Raises ValueError if the cache
+    was written by another version or for different settings, OSError if it is missing.
+    """
+    utils.logger.info(f"Loading chords/graph cache from {path}...")
+    header, chords, graph = read_cache(path)
+    if header["config_hash"] != config_hash():
+        raise ValueError("cache is stale for the current config")
+    return chords, graph
+
+
+def update_cache(path=config.cache_dir):
+    """
+    Bring a stale cache up to date with the current config and rewrite it in place, redoing only what changed.
+    Chord types whose intervals are unchanged keep their cached voicings (unless the octave range moved) and all
+    edges among themselves, since edges depend only on pitch classes; only edges touching added or changed chord
+    types are computed, from a pitch class index. Raises ValueError if the note names changed, which invalidates
+    everything.
+    """
+    utils.logger.info(f"Updating chords/graph cache in {path}...")
+    header, old_chords, old_graph = read_cache(path)
+    old_settings = header["settings"]
+    if old_settings["notes"] != config.notes:
+        raise ValueError("note names changed")
+    old_intervals = dict(old_settings["intervals"])
+    same_octaves = (old_settings["lower_octave"], old_settings["upper_octave"]) == \
+        (config.lower_octave, config.upper_octave)
+    old_nodes = {chord_name: i for i, chord_name in enumerate(header["chord_names"])}
+
+    # Chords in get_chords order (one node per chord name), reusing cached voicings where possible
+    chords = {}
+    kept = []  # (old node, new node) for chord types whose intervals did not change
+    added = []
+    for root in config.notes:
+        for chord_type, interval_pattern in config.intervals.items():
+            chord_name = f"{root} {chord_type.replace('_', ' ')}"
+            unchanged = old_intervals.get(chord_type) == interval_pattern and chord_name in old_nodes
+            if unchanged and same_octaves:
+                chords[chord_name] = old_chords[chord_name]
+            else:
+                chord = [(config.notes.index(root) + interval) % 12 for interval in interval_pattern]
+                chords[chord_name] = [
+                    utils.voice_chord(inversion, octave) for inversion in utils.get_inversions(chord)
+                    for octave in range(config.lower_octave, config.upper_octave)
+                ]
+            if unchanged:
+                kept.append((old_nodes[chord_name], len(chords) - 1))
+            else:
+                added.append(len(chords) - 1)
+    node_notes = [chord_list[-1] for chord_list in chords.values()]  # generate_graph keeps the last voicing
+    masks = [pitches.pitch_class_mask(notes) for notes in node_notes]
+
+    # Edges among unchanged chord types carry over, renumbered
+    new_position = np.full(len(old_graph), -1, dtype=np.int64)
+    for old, new in kept:
+        new_position[old] = new
+    sources = np.repeat(np.arange(len(old_graph)), np.diff(old_graph.indptr))
+    targets = np.asarray(old_graph.indices)
+    carried = (sources < targets) & (new_position[sources] >= 0) & (new_position[targets] >= 0)
+    edges = set(zip(new_position[sources[carried]].tolist(), new_position[targets[carried]].tolist()))
+
+    # Edges touching added or changed chord types, from chords with one more or one fewer pitch class
+    nodes_by_mask = parallel.mask_index(masks)
+    for node in added:
+        for neighbor in parallel.mask_neighbors(nodes_by_mask, masks[node]):
+            edges.add((min(node, neighbor), max(node, neighbor)))
+    utils.logger.info(f"Kept {len(kept)} nodes, added or changed {len(added)}, "
+                      f"removed {len(old_graph) - len(kept)}")
+
+    # Rewrite the cache
+    graph = ChordGraph.from_edges([f"chord_{i}" for i in range(len(chords))], list(chords), node_notes, sorted(edges))
+    save_cache(chords, graph, path)
+    return chords, graph
+
+
+def build(save=config.generate_intermediate_files):
+    """
+    Generate chords and the compact chord graph from the config file, optionally saving them to the cache.
+    """
+    chords = utils.get_chords()
+
+    # Same nodes and edges as utils.generate_graph, without building a networkx graph first
+    node_notes = [chord_list[-1] for chord_list in chords.values()]  # generate_graph keeps the last voicing
+    edges = parallel.build_edges([pitches.pitch_class_mask(notes) for notes in node_notes])
+    graph = ChordGraph.from_edges([f"chord_{i}" for i in range(len(chords))], list(chords), node_notes, edges)
+    if save:
+        try:
+            save_cache(chords, graph)
+        except OSError as e:
+            utils.logger.warning(f"Could not save chords/graph cache: {e}")
+            utils.logger.info("Skipping...")
+    return chords, graph
+
+
+def load_or_build():
+    """
+    Load chords and graph from the cache. If the cache is stale, update it incrementally; if it is missing or
+    cannot be updated, regenerate both and rewrite it.
+    """
+    try:
+        return load_cache()
+    except ValueError:
+        try:
+            return update_cache()
+        except (OSError, ValueError) as e:
+            utils.logger.warning(f"Could not update chords/graph cache: {e}")
+            utils.logger.info("Proceeding with auto-generation of chords and graph")
+            return build(save=True)
+    except OSError as e:
+        utils.logger.warning(f"Could not use chords/graph cache: {e}")
+        utils.logger.info("Proceeding with auto-generation of chords and graph")
+        return build(save=True)
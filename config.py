@@ -1,19 +1,46 @@
-import numpy as np
-
-
 # Generate or use pre-saved files
 use_existing_files = False
-generate_intermediate_files = False  # will save chords list, network graph as files
-chords_file = "chords.json"
-graph_file = "chords_graph.pkl"
+generate_intermediate_files = False  # will save the chords/graph cache (binary) as files
+cache_dir = "chords_cache"  # versioned binary chords/graph cache, memory-mapped on load
+lazy_graph = False  # compute each chord's neighborhood on first visit instead of building the whole graph up front
+lazy_graph_cache_size = 4096  # chords whose notes/neighbors are memoized in lazy mode
+
+# Parallel build settings
+parallel_threshold = 20000  # chords from which edges/distances are computed in tiles across a process pool
+parallel_workers = None  # worker processes (None: one per core)
+parallel_tile_size = 2048  # chords per tile side
+parallel_dir = "parallel_build"  # on-disk edge lists, distance matrices and MDS scratch space
+
+# Random walk settings
+weighted_walk = False  # False: move to a uniformly chosen neighbor; True: weight transitions as below
+transition_voice_leading = 1.0  # weights decay as exp(-k * distance_metric) between chords (smoother voice leading)
+transition_octave = 1.0  # weights decay as exp(-k * register difference in octaves) (stay in a similar register)
+transition_novelty = .5  # weights scale as degree(target) ** -k (favor chords the walk otherwise rarely reaches)
 
 # Audio settings
 sample_rate = 44100
-duration = 8  # seconds that the base chord will play
-t = np.linspace(0, duration, int(sample_rate * duration), False)
+duration = 8  # seconds that the base chord will play (time axis `t` is built on first use, see __getattr__)
 fade = True
 attack_time = duration * .1  # fade in (s)
 release_time = duration * .1  # fade out
+synthesis_block_size = 16384  # samples rendered per batched oscillator step
+
+# Streaming settings
+block_duration = .5  # seconds of audio mixed per block when rendering/serving (live playback uses chord-length blocks)
+crossfade = 0  # seconds of overlap between consecutive base chords
+
+# Lookahead settings
+lookahead_depth = 2  # chords pre-rendered while the current one plays, at least 1 (0 is treated as 1)
+lookahead_bytes = 64 * 2**20  # memory cap for pre-rendered chord buffers
+
+# Instrumentation settings
+metrics_enabled = True  # collect latency/timing metrics in the audio worker
+metrics_interval = 60  # seconds between metrics summaries in the log
+metrics_file = None  # append each summary as a JSON line to this file
+
+# Waveform cache settings
+wave_cache_bytes = 256 * 2**20  # memory cap for rendered chord/note buffers
+cache_report_interval = 100  # chords between cache hit rate log lines
 
 # Base chord settings
 A4_freq = 440.0
@@ -23,6 +50,7 @@ upper_octave = 4
 # Supplemental note settings
 lower_length_supplemental = .04  # lower/upper bounds for individual note duration
 upper_length_supplemental = 1.5
+supplemental_length_step = .01  # note durations are rounded to this step (s) so rendered notes can be reused
 lower_octave_supplemental = -2  # lower/upper bounds for individual note octavt
 upper_octave_supplemental = 3
 repetition_length_threshold = .4  # duration threshold below which individual note will repeat
@@ -43,3 +71,15 @@ intervals = {
     # "diminished": [0, 3, 6],  # minor third, diminished fifth
     # "augmented": [0, 4, 8],  # major third, augmented fifth
 }
+
+
+def __getattr__(name):
+    """
+    Build the default time axis (config.t) on first access rather than at import, so that importing the config
+    does not pull in numpy.
+    """
+    if name == "t":
+        import numpy as np
+        globals()["t"] = np.linspace(0, duration, int(sample_rate * duration), False)
+        return globals()["t"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
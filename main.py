@@ -1,38 +1,67 @@
+import argparse
 import random
-from multiprocessing import Process
 
+import audio
+import chord_graph
 import config
+import transitions
 import utils
 
 
+def parse_args():
+    """
+    Command line options. With no options the soundscape plays live, indefinitely.
+    """
+    parser = argparse.ArgumentParser(description="Ambient soundscape generated by walking a network of chords.")
+    parser.add_argument("--render", metavar="PATH", help="render headlessly to a WAV (or .pcm/.raw) file instead")
+    parser.add_argument("--chords", type=int, help="number of chords to render")
+    parser.add_argument("--minutes", type=float, help="minutes of audio to render")
+    parser.add_argument("--seed", type=int, help="random seed, for reproducible walks")
+    args = parser.parse_args()
+    if args.render and args.chords is None and args.minutes is None:
+        parser.error("--render requires --chords and/or --minutes")
+    return args
+
+
 if __name__ == '__main__':
+    args = parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
 
-    # Get chords, chord graph. Will auto-generate if chords/graph file throws errors.
-    if config.use_existing_files:
-        chords = utils.load_chords()
-        frequencies = utils.generate_frequencies()
-        graph = utils.load_graph(chords, frequencies)
+    # Get chord graph: built lazily as the walk visits it, or up front (auto-generated, and re-cached, if the cache
+    # is missing or stale)
+    if config.lazy_graph:
+        graph = chord_graph.LazyChordGraph()
+    elif config.use_existing_files:
+        _, graph = chord_graph.load_or_build()
     else:
-        chords = utils.get_chords()
-        frequencies = utils.generate_frequencies()
-        graph = utils.generate_graph(chords, frequencies)
+        _, graph = chord_graph.build()
+
+    # Transition model for the walk: uniform over neighbors, or precomputed weighted tables
+    walk = transitions.for_graph(graph)
+
+    # Select an initial node
+    current_node = random.randrange(len(graph))
 
-    # Select an initial node, initiate the playback loop
+    # Offline rendering: walk the graph faster than real time and write the mix to disk
+    if args.render:
+        audio.render_to_file(
+            graph, current_node, args.render, num_chords=args.chords, minutes=args.minutes, transitions=walk
+        )
+        raise SystemExit
+
+    # Start the streaming audio worker once; the graph is only shipped to it at startup
+    engine = audio.AudioEngine(graph)
+
+    # Initiate the playback loop
     utils.logger.info("Initiating generative loop...")
-    current_node = random.choice(list(graph.nodes()))
-    audio_segments = []
-    while True:
-
-        # Create concurrently running audio threads
-        process1 = Process(target=utils.play_base_chord, args=(graph, current_node,))
-        process2 = Process(target=utils.play_supplement, args=(graph, current_node,))
-
-        # Manage processes
-        process1.start()
-        process2.start()
-        process1.join()
-        process2.join()
-
-        # Select new node
-        random_edge = random.choice(list(graph.edges(current_node)))
-        current_node = random_edge[1] if random_edge[0] == current_node else random_edge[0]
+    try:
+        while True:
+
+            # Hand the node to the mixer, which schedules its base chord and supplement
+            engine.play(current_node)
+
+            # Select new node
+            current_node = walk.step(current_node)
+    finally:
+        engine.close()
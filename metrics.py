@@ -0,0 +1,136 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+import config
+import utils
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram with geometrically spaced bounds (factor of 2, from 10 microseconds up), so recording a
+    value is a binary search and an increment. Quantiles are approximated by bucket upper bounds.
+    """
+    bounds = [1e-5 * 2 ** i for i in range(28)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(.5),
+            "p95": self.quantile(.95),
+            "p99": self.quantile(.99),
+            "max": self.max,
+        }
+
+
+class Metrics:
+    """
+    Lightweight performance instrumentation for the generative loop: named histograms, counters and gauges, with a
+    periodic summary through utils.logger and optionally appended as JSON lines to a metrics file. Safe to share
+    between threads; does nothing when disabled.
+    """
+
+    def __init__(self, enabled=config.metrics_enabled, interval=config.metrics_interval,
+                 metrics_file=config.metrics_file):
+        self.enabled = enabled
+        self.interval = interval
+        self.metrics_file = metrics_file
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+        self.last_report = time.monotonic()
+
+    def record(self, name, value):
+        """
+        Add a value to a histogram: seconds, or a plain ratio for names ending in _ratio.
+        """
+        if self.enabled:
+            with self.lock:
+                self.histograms.setdefault(name, Histogram()).record(value)
+
+    def increment(self, name, amount=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set(self, name, value):
+        if self.enabled:
+            self.gauges[name] = value
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Record the wall-clock duration of a block in the named histogram.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def summary(self):
+        with self.lock:
+            return {
+                "time": time.time(),
+                "histograms": {name: histogram.summary() for name, histogram in self.histograms.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+            }
+
+    def maybe_report(self):
+        """
+        Report if the configured interval has passed since the last report.
+        """
+        if self.enabled and time.monotonic() - self.last_report >= self.interval:
+            self.report()
+
+    def report(self):
+        """
+        Log a one-line summary per histogram plus counters and gauges, and append the full summary to the metrics
+        file if one is configured.
+        """
+        if not self.enabled:
+            return
+        self.last_report = time.monotonic()
+        summary = self.summary()
+        for name, stats in summary["histograms"].items():
+            if name.endswith("_ratio"):
+                values = {key: f"{stats[key]:.4f}" for key in ("mean", "p95", "max")}
+            else:
+                values = {key: f"{stats[key] * 1000:.2f}ms" for key in ("mean", "p95", "max")}
+            utils.logger.info(
+                f"Metrics {name}: n={stats['count']} mean={values['mean']} p95={values['p95']} max={values['max']}"
+            )
+        if summary["counters"] or summary["gauges"]:
+            utils.logger.info(f"Metrics counters: {summary['counters']}, gauges: {summary['gauges']}")
+        if self.metrics_file:
+            try:
+                with open(self.metrics_file, "a") as f:
+                    f.write(json.dumps(summary) + "\n")
+            except OSError as e:
+                utils.logger.warning(f"Could not write metrics file: {e}")
@@ -0,0 +1,169 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import logging
+import os
+
+import numpy as np
+
+import config
+
+
+# Set up logging infrastructure
+logger = logging.getLogger(__name__)
+
+# Per-worker state, set once by the pool initializer instead of being shipped with every tile
+worker_state = {}
+
+
+def mask_index(masks):
+    """
+    Index chords by pitch class bitmask: {mask: [chord indices]}.
+    """
+    index = {}
+    for i, mask in enumerate(masks):
+        index.setdefault(mask, []).append(i)
+    return index
+
+
+def mask_neighbors(index, mask):
+    """
+    Chords, from a mask_index, whose pitch class set is the given one with a single note added or removed.
+    """
+    for bit in range(len(config.notes)):
+        yield from index.get(mask ^ (1 << bit), ())
+
+
+def chord_edges(masks, start=0, end=None, index=None):
+    """
+    Return the sorted index pairs (i, j), i < j, of chords whose pitch class sets differ by exactly one note, given
+    one pitch class bitmask per chord, for the chords i in [start, end) (all by default). Since the symmetric
+    difference has a single element, one set is always the other plus or minus one note, so neighbors are looked up
+    in a mask index rather than found by comparing all pairs: work is proportional to the number of edges.
+    """
+    index = mask_index(masks) if index is None else index
+    edges = []
+    for i in range(start, len(masks) if end is None else end):
+        edges.extend((i, j) for j in mask_neighbors(index, masks[i]) if j > i)
+    edges.sort()  # same order as a pass over all pairs, so graph adjacency order is unchanged
+    return edges
+
+
+def init_edge_worker(masks):
+    worker_state["masks"] = masks
+    worker_state["index"] = mask_index(masks)
+
+
+def edge_tile(start, end):
+    """
+    Edges for the chords in [start, end), as an array.
+    """
+    edges = chord_edges(worker_state["masks"], start, end, worker_state["index"])
+    return start, np.array(edges, dtype=np.int64).reshape(-1, 2)
+
+
+def parallel_edges(masks, path, workers=config.parallel_workers, tile_size=config.parallel_tile_size):
+    """
+    Compute the edge list of chord_edges across a process pool, one tile of chords per task, and write it to
+    an .npy file on disk. Returns the edges memory-mapped from that file, sorted as chord_edges returns them.
+    """
+    masks = list(masks)
+    tiles = [(start, min(start + tile_size, len(masks))) for start in range(0, len(masks), tile_size)]
+    logger.info(f"Computing edges for {len(masks)} chords in {len(tiles)} tiles...")
+
+    # Each tile's edges go to a temporary file as soon as it completes
+    tile_files = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_edge_worker, initargs=(masks,)) as pool:
+        futures = [pool.submit(edge_tile, start, end) for start, end in tiles]
+        for done, future in enumerate(as_completed(futures), 1):
+            start, edges = future.result()
+            tile_files[start] = f"{path}.{start}.tmp.npy"
+            np.save(tile_files[start], edges)
+            if done % max(len(tiles) // 10, 1) == 0 or done == len(tiles):
+                logger.info(f"Edges: {done}/{len(tiles)} tiles done")
+
+    # Concatenate tiles, in row order, into the final edge list
+    counts = {start: np.load(file, mmap_mode="r").shape[0] for start, file in tile_files.items()}
+    edges = np.lib.format.open_memmap(path, mode="w+", dtype=np.int64, shape=(sum(counts.values()), 2))
+    offset = 0
+    for start in sorted(tile_files):
+        edges[offset:offset + counts[start]] = np.load(tile_files[start])
+        offset += counts[start]
+        os.remove(tile_files[start])
+    edges.flush()
+    return np.load(path, mmap_mode="r")
+
+
+def init_distance_worker(features, path):
+    worker_state["features"] = features
+    worker_state["distances"] = np.load(path, mmap_mode="r+")
+
+
+def distance_tile(rows, cols):
+    """
+    Fill one tile of the shared distance matrix, and its mirror image below the diagonal.
+    """
+    from trinity_visualization import trinity_utils
+
+    distances = worker_state["distances"]
+    tile = trinity_utils.pairwise_distances(worker_state["features"], slice(*rows), slice(*cols))
+    distances[rows[0]:rows[1], cols[0]:cols[1]] = tile
+    distances[cols[0]:cols[1], rows[0]:rows[1]] = tile.T
+    distances.flush()
+
+
+def parallel_distances(features, path, workers=config.parallel_workers, tile_size=config.parallel_tile_size,
+                       dtype=np.float64):
+    """
+    Compute the full pairwise distance matrix of trinity_utils.pairwise_distances across a process pool, tile by
+    tile over the upper triangle, into a memory-mapped .npy file on disk. Returns the matrix, memory-mapped read-only.
+    """
+    n = len(features["mask"])
+    np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(n, n)).flush()
+    bounds = [(start, min(start + tile_size, n)) for start in range(0, n, tile_size)]
+    tiles = [(rows, cols) for i, rows in enumerate(bounds) for cols in bounds[i:]]
+    logger.info(f"Computing distances for {n} chords in {len(tiles)} tiles...")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_distance_worker, initargs=(features, path)) as pool:
+        futures = [pool.submit(distance_tile, rows, cols) for rows, cols in tiles]
+        for done, future in enumerate(as_completed(futures), 1):
+            future.result()
+            if done % max(len(tiles) // 10, 1) == 0 or done == len(tiles):
+                logger.info(f"Distances: {done}/{len(tiles)} tiles done")
+    return np.load(path, mmap_mode="r")
+
+
+def build_edges(masks, name="edges"):
+    """
+    Edges between chords given their pitch class masks: computed in-process by chord_edges for small
+    vocabularies, or tiled across a process pool into parallel_dir from config.parallel_threshold chords.
+    """
+    if len(masks) < config.parallel_threshold:
+        return chord_edges(masks)
+    os.makedirs(config.parallel_dir, exist_ok=True)
+    return parallel_edges(masks, os.path.join(config.parallel_dir, f"{name}.npy"))
+
+
+def build_distances(features, name="distances"):
+    """
+    Full pairwise distance matrix for chord features: computed in memory for small vocabularies, or tiled across a
+    process pool into a memory-mapped file in parallel_dir from config.parallel_threshold chords.
+    """
+    from trinity_visualization import trinity_utils
+
+    if len(features["mask"]) < config.parallel_threshold:
+        return trinity_utils.pairwise_distances(features)
+    os.makedirs(config.parallel_dir, exist_ok=True)
+    return parallel_distances(features, os.path.join(config.parallel_dir, f"{name}.npy"))
+
+
+def scratch_copy(matrix, name, block_size=config.parallel_tile_size):
+    """
+    Writable copy of a memory-mapped matrix in its own scratch .npy file in parallel_dir, copied one block of rows
+    at a time, for algorithms that work in place (e.g. classical MDS) without overwriting the original file.
+    """
+    os.makedirs(config.parallel_dir, exist_ok=True)
+    path = os.path.join(config.parallel_dir, f"{name}.npy")
+    scratch = np.lib.format.open_memmap(path, mode="w+", dtype=matrix.dtype, shape=matrix.shape)
+    for start in range(0, len(matrix), block_size):
+        scratch[start:start + block_size] = matrix[start:start + block_size]
+    scratch.flush()
+    return scratch
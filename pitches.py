@@ -0,0 +1,76 @@
+import numpy as np
+
+import config
+
+
+# Notes are MIDI-style note numbers: 12 per octave, C-1 = 0, C4 = 60, A4 = 69. Chords are lists of note numbers, or
+# for vectorized work, rows of a padded integer array (see pad).
+A4_NUMBER = 69
+
+
+def note_name(number):
+    """
+    Name of a note number, e.g. 61 -> C#4.
+    """
+    return f"{config.notes[number % 12]}{number // 12 - 1}"
+
+
+def note_names(numbers):
+    return [note_name(int(number)) for number in numbers]
+
+
+def frequencies(numbers):
+    """
+    Equal-tempered frequencies (Hz, rounded to 2 decimals) of note numbers, relative to config.A4_freq.
+    """
+    return np.round(config.A4_freq * 2 ** ((np.asarray(numbers) - A4_NUMBER) / 12), 2)
+
+
+def pitch_class_mask(numbers):
+    """
+    Encode the pitch classes of a chord as a bitmask, bit i standing for config.notes[i].
+
+    Input: [E3 G3 C4]
+    Output: 0b000010010001
+    """
+    mask = 0
+    for number in numbers:
+        mask |= 1 << (number % 12)
+    return mask
+
+
+def pad(chords):
+    """
+    Stack chords of any sizes into a (chords, max notes) int16 array, -1 padded, plus the number of notes per chord.
+    """
+    counts = np.array([len(chord) for chord in chords], dtype=np.int8)
+    notes = np.full((len(chords), int(counts.max()) if len(chords) else 0), -1, dtype=np.int16)
+    for i, chord in enumerate(chords):
+        notes[i, :len(chord)] = chord
+    return notes, counts
+
+
+def pitch_class_masks(notes):
+    """
+    pitch_class_mask for every row of a padded note array.
+    """
+    bits = np.where(notes >= 0, np.left_shift(1, notes % 12, dtype=np.int64), 0)
+    return np.bitwise_or.reduce(bits, axis=1)
+
+
+def modal_octaves(notes):
+    """
+    Most common octave of every row of a padded note array, ties going to the lower octave.
+    """
+    octaves = notes // 12 - 1
+    valid = notes >= 0
+    counts = ((octaves[:, :, np.newaxis] == octaves[:, np.newaxis, :]) & valid[:, np.newaxis, :]).sum(axis=2)
+    ranks = np.where(valid, counts * 1024 - octaves, np.iinfo(np.int64).min)  # higher count, then lower octave
+    return octaves[np.arange(len(notes)), ranks.argmax(axis=1)]
+
+
+def mean_octaves(notes, counts):
+    """
+    Mean octave of every row of a padded note array.
+    """
+    return np.where(notes >= 0, notes // 12 - 1, 0).sum(axis=1) / counts
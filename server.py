@@ -0,0 +1,169 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import time
+
+import audio
+import chord_graph
+import config
+import transitions
+import utils
+
+
+class FileSink:
+    """
+    Write a stream's raw PCM (16-bit mono) to a file.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "wb")
+
+    async def start(self):
+        pass
+
+    async def write(self, data):
+        self.file.write(data)
+
+    async def close(self):
+        self.file.close()
+
+
+class SocketSink:
+    """
+    Serve a stream's raw PCM (16-bit mono) on a Unix domain socket. Every connected client receives the stream live
+    from the moment it connects; with no clients connected, blocks are dropped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.clients = set()
+        self.server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self.connect, path=self.path)
+
+    async def connect(self, reader, writer):
+        self.clients.add(writer)
+
+    async def write(self, data):
+        for writer in list(self.clients):
+            try:
+                writer.write(data)
+                await writer.drain()
+            except (ConnectionError, OSError):
+                self.clients.discard(writer)
+                writer.close()
+
+    async def close(self):
+        for writer in self.clients:
+            writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+        os.unlink(self.path)
+
+
+async def run_stream(G, sink, seed, seconds=None, realtime=True, transitions=None):
+    """
+    Generate one soundscape into a sink: its own random walk and mixer, seeded independently of other streams.
+    In real-time mode the stream is paced to stay about one block ahead of the wall clock. Returns the seconds of
+    audio produced.
+    """
+    rng = random.Random(seed)
+    walker = audio.Walker(G, rng.randrange(len(G)), rng=rng, transitions=transitions)
+    block_seconds = walker.mixer.block_size / config.sample_rate
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    produced = 0.0
+    await sink.start()
+    try:
+        while seconds is None or produced < seconds:
+            await sink.write(walker.next_block().tobytes())
+            produced += block_seconds
+            await asyncio.sleep(max(start + produced - block_seconds - loop.time(), 0) if realtime else 0)
+    finally:
+        await sink.close()
+    return produced
+
+
+def serve_streams(G, walk, streams, args, results):
+    """
+    Run a group of streams multiplexed on one asyncio loop, then report audio produced and CPU time used.
+    """
+    def make_sink(index):
+        if args.sink == "socket":
+            return SocketSink(os.path.join(args.output_dir, f"stream_{index}.sock"))
+        return FileSink(os.path.join(args.output_dir, f"stream_{index}.pcm"))
+
+    async def run_all():
+        return await asyncio.gather(*(
+            run_stream(G, make_sink(index), args.seed + index, seconds=args.seconds, realtime=not args.fast,
+                       transitions=walk)
+            for index in streams
+        ))
+
+    cpu_start = time.process_time()
+    audio_seconds = sum(asyncio.run(run_all()))
+    results.put((audio_seconds, time.process_time() - cpu_start))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve many independent soundscapes from one chord graph.")
+    parser.add_argument("--streams", type=int, default=4, help="number of independent streams")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes sharing the streams")
+    parser.add_argument("--sink", choices=["file", "socket"], default="file",
+                        help="write raw PCM to files, or serve it on Unix sockets")
+    parser.add_argument("--output-dir", default="streams", help="directory for stream files/sockets")
+    parser.add_argument("--seconds", type=float, help="seconds of audio per stream (default: run forever)")
+    parser.add_argument("--fast", action="store_true", help="do not pace streams to real time (throughput test)")
+    parser.add_argument("--seed", type=int, default=0, help="stream i uses seed + i")
+    args = parser.parse_args()
+    if args.fast and args.seconds is None:
+        parser.error("--fast requires --seconds")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # Load the chord graph and pre-render every base chord once; workers are forked (not spawned), so they share both
+    # read-only. A lazy graph is only filled in as the walks reach it, so each worker grows its own.
+    if config.lazy_graph:
+        graph = chord_graph.LazyChordGraph()
+    else:
+        if config.use_existing_files:
+            _, graph = chord_graph.load_or_build()
+        else:
+            _, graph = chord_graph.build()
+        for node in range(len(graph)):
+            utils.generate_chord_wave(graph.node_frequencies(node))
+        utils.log_wave_cache_stats()
+
+    # Transition tables are also computed once and shared
+    walk = transitions.for_graph(graph)
+
+    # Spread streams over the worker processes
+    workers = max(min(args.workers, args.streams), 1)
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [
+        context.Process(target=serve_streams, args=(graph, walk, range(w, args.streams, workers), args, results))
+        for w in range(workers)
+    ]
+    utils.logger.info(f"Serving {args.streams} streams on {workers} workers ({args.sink} sinks in {args.output_dir})")
+    wall_start = time.perf_counter()
+    for process in processes:
+        process.start()
+
+    # Throughput: seconds of audio produced per CPU second is the number of real-time streams one core sustains
+    audio_seconds = cpu_seconds = 0.0
+    for _ in processes:
+        produced, used = results.get()
+        audio_seconds += produced
+        cpu_seconds += used
+    for process in processes:
+        process.join()
+    wall_seconds = time.perf_counter() - wall_start
+    utils.logger.info(
+        f"Produced {audio_seconds:.0f}s of audio in {wall_seconds:.1f}s wall / {cpu_seconds:.1f}s CPU: "
+        f"{audio_seconds / max(cpu_seconds, 1e-9):.1f} real-time streams per core"
+    )
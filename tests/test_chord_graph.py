@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+import chord_graph
+import config
+
+
+# Config changes the cache must follow: (description, {setting: new value})
+changes = [
+    ("added chord type", {"intervals": {**config.intervals, "diminished": [0, 3, 6]}}),
+    ("removed chord type", {"intervals": {k: v for k, v in config.intervals.items() if k != "minor"}}),
+    ("changed chord type", {"intervals": {**config.intervals, "major_seventh": [0, 4, 7, 10]}}),
+    ("octave bounds", {"lower_octave": config.lower_octave - 1, "upper_octave": config.upper_octave + 1}),
+    ("A4 frequency", {"A4_freq": 432.0}),
+]
+
+
+@pytest.mark.parametrize("settings", [settings for _, settings in changes], ids=[name for name, _ in changes])
+def test_update_cache_matches_build(tmp_path, monkeypatch, settings):
+    """
+    Updating a stale cache in place gives the same chords and graph as building from scratch.
+    """
+    path = str(tmp_path / "cache")
+    chords, graph = chord_graph.build(save=False)
+    chord_graph.save_cache(chords, graph, path)
+
+    for name, value in settings.items():
+        monkeypatch.setattr(config, name, value)
+    with pytest.raises(ValueError):
+        chord_graph.load_cache(path)
+    updated_chords, updated = chord_graph.update_cache(path)
+    built_chords, built = chord_graph.build(save=False)
+
+    assert updated_chords == built_chords
+    assert np.array_equal(updated.indptr, built.indptr)
+    assert np.array_equal(updated.indices, built.indices)
+    assert np.array_equal(updated.frequencies, built.frequencies)
+
+    # The rewritten cache is valid for the new config
+    loaded_chords, loaded = chord_graph.load_cache(path)
+    assert loaded_chords == built_chords
+    assert np.array_equal(loaded.indices, built.indices)
@@ -0,0 +1,143 @@
+import random
+
+import numpy as np
+
+import config
+import utils
+
+
+def alias_table(weights):
+    """
+    Vose's alias table for sampling index k with probability weights[k] / sum(weights): draw a uniform slot k and
+    keep it with probability probabilities[k], otherwise take aliases[k].
+    """
+    n = len(weights)
+    total = weights.sum()
+    scaled = weights * n / total if total > 0 else np.ones(n)
+    probabilities = np.ones(n)
+    aliases = np.arange(n, dtype=np.int32)
+    small = [k for k in range(n) if scaled[k] < 1]
+    large = [k for k in range(n) if scaled[k] >= 1]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        probabilities[less] = scaled[less]
+        aliases[less] = more
+        scaled[more] -= 1 - scaled[less]
+        (small if scaled[more] < 1 else large).append(more)
+    return probabilities, aliases
+
+
+class TransitionModel:
+    """
+    Weighted random walk over a ChordGraph. Edge weights are computed once and turned into one alias table per
+    node, stored flat alongside the graph's CSR adjacency, so a weighted step costs one random number and a couple
+    of array lookups, independent of degree. Long walks can also be generated ahead of time in a batch.
+    """
+
+    def __init__(self, indptr, indices, probabilities, aliases):
+        self.indptr = indptr
+        self.indices = indices
+        self.probabilities = probabilities  # per edge slot: chance of keeping the slot drawn
+        self.aliases = aliases  # per edge slot: fallback slot, relative to the node's first edge
+
+        # Plain lists for the scalar step, where per-element NumPy access would dominate
+        self.indptr_list = indptr.tolist()
+        self.indices_list = indices.tolist()
+        self.probabilities_list = probabilities.tolist()
+        self.aliases_list = aliases.tolist()
+
+    @classmethod
+    def from_graph(cls, graph, voice_leading=None, octave=None, novelty=None):
+        """
+        Precompute transition tables for a ChordGraph. The weight of the edge from chord i to chord j is the product:
+            - voice leading: exp(-voice_leading * distance_metric(i, j))
+            - octave proximity: exp(-octave * |register(i) - register(j)|), register being log2 of mean frequency
+            - novelty: degree(j) ** -novelty, since a uniform walk reaches chords in proportion to their degree
+        Coefficients default to the config values.
+        """
+        from trinity_visualization import trinity_utils
+
+        voice_leading = config.transition_voice_leading if voice_leading is None else voice_leading
+        octave = config.transition_octave if octave is None else octave
+        novelty = config.transition_novelty if novelty is None else novelty
+        utils.logger.info("Precomputing chord transition tables...")
+
+        # Source and target of every directed edge slot, in CSR order
+        degrees = np.diff(graph.indptr)
+        sources = np.repeat(np.arange(len(graph)), degrees)
+        targets = graph.indices.astype(np.int64)
+
+        # Edge weights
+        features = trinity_utils.chord_features([graph.node_notes(node) for node in range(len(graph))])
+        registers = np.log2([graph.node_frequencies(node).mean() for node in range(len(graph))])
+        weights = np.exp(-voice_leading * trinity_utils.paired_distances(features, sources, targets))
+        weights *= np.exp(-octave * np.abs(registers[sources] - registers[targets]))
+        weights *= degrees[targets].astype(float) ** -novelty
+
+        # One alias table per node, over that node's edge slots
+        probabilities = np.ones(len(targets))
+        aliases = np.zeros(len(targets), dtype=np.int32)
+        for node in range(len(graph)):
+            start, end = graph.indptr[node], graph.indptr[node + 1]
+            if end > start:
+                probabilities[start:end], aliases[start:end] = alias_table(weights[start:end])
+        return cls(graph.indptr, graph.indices, probabilities, aliases)
+
+    def step(self, node, rng=random):
+        """
+        Take one step of the weighted random walk. A node without neighbors is repeated.
+        """
+        start = self.indptr_list[node]
+        degree = self.indptr_list[node + 1] - start
+        if not degree:
+            return node
+        u = rng.random() * degree
+        slot = start + int(u)
+        if u - int(u) >= self.probabilities_list[slot]:
+            slot = start + self.aliases_list[slot]
+        return self.indices_list[slot]
+
+    def walk(self, start, steps, rng=random):
+        """
+        Generate a walk of the given number of steps from a start node, as a list of nodes including the start.
+        """
+        nodes = [start]
+        for _ in range(steps):
+            nodes.append(self.step(nodes[-1], rng))
+        return nodes
+
+    def walks(self, starts, steps, seed=None):
+        """
+        Generate many walks at once, one per start node, vectorized across walks. Returns an array of shape
+        (len(starts), steps + 1) whose rows are the walks, including their start nodes.
+        """
+        rng = np.random.default_rng(seed)
+        nodes = np.empty((len(starts), steps + 1), dtype=np.int32)
+        nodes[:, 0] = starts
+        if not len(self.indices):
+            nodes[:] = nodes[:, :1]
+            return nodes
+        degrees = np.diff(self.indptr)
+        for step in range(steps):
+            current = nodes[:, step]
+            degree = degrees[current]
+            u = rng.random(len(starts)) * degree
+            drawn = u.astype(np.int64)
+            slot = np.minimum(self.indptr[current] + drawn, len(self.indices) - 1)
+            slot = np.where(u - drawn < self.probabilities[slot], slot, self.indptr[current] + self.aliases[slot])
+            nodes[:, step + 1] = np.where(degree > 0, self.indices[np.minimum(slot, len(self.indices) - 1)], current)
+        return nodes
+
+
+def for_graph(graph):
+    """
+    The transition model set up in the config: weighted tables for the graph if weighted_walk is set, otherwise the
+    graph itself, whose step picks neighbors uniformly. A lazy graph is never fully built, so it always walks
+    uniformly.
+    """
+    if not config.weighted_walk:
+        return graph
+    if not hasattr(graph, "indptr"):
+        utils.logger.warning("Weighted transitions need the full chord graph; walking the lazy graph uniformly")
+        return graph
+    return TransitionModel.from_graph(graph)
@@ -1,23 +1,23 @@
+import chord_graph
 import config
 import utils
-from . import trinity_utils
+from . import trinity_config, trinity_utils
 
 
 if __name__ == "__main__":
 
-    # Get chords, chord graph. Will auto-generate if chords/graph file throws errors.
+    # Get chords, chord graph. Will auto-generate (and re-cache) if the cache is missing or stale.
     if config.use_existing_files:
-        chords = utils.load_chords()
-        frequencies = utils.generate_frequencies()
+        chords, _ = chord_graph.load_or_build()
     else:
         chords = utils.get_chords()
-        frequencies = utils.generate_frequencies()
 
     # Compute pairwise distances of chord nodes
     chords_with_vectors, vector_coordinates = trinity_utils.generate_vector_space(chords)
 
     # Generate graph
-    network = trinity_utils.generate_trinity_graph(chords_with_vectors, frequencies)
+    network = trinity_utils.generate_trinity_graph(chords_with_vectors)
 
     # Visualize using plotly (for preliminary exploration prior to Trinity import)
-    trinity_utils.render_graph(network, vector_coordinates)
+    if trinity_config.render_preview:
+        trinity_utils.render_graph(network, vector_coordinates)
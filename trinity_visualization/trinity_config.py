@@ -1,5 +1,17 @@
 # Generate or use pre-saved files
-trinity_graph = "trinity_graph.json"
+trinity_graph = "trinity_graph.json"  # a .gz suffix writes gzip-compressed output
+trinity_format = "json"  # "json" (single document) or "ndjson" (header, then one node/edge object per line)
+
+# Preview (plotly) variables
+render_preview = True  # False: only export the Trinity JSON (plotly and pandas are then never imported)
+preview_max_edges = 20000  # edges beyond this are randomly subsampled in the preview (None: draw all)
+preview_octaves = None  # only show chords in these octaves, e.g. ["3", "4"] (None: all)
+preview_html = None  # write a self-contained HTML file to this path instead of opening a browser
+
+# Embedding variables
+embedding_method = "classical"  # "classical" (eigendecomposition), "landmark" (scales to large chord sets) or "smacof"
+embedding_landmarks = 256  # number of landmark chords used by the "landmark" method
+embedding_cache_dir = "embedding_cache"  # cached coordinates, keyed by chord set and distance settings (None: off)
 
 # Distance metric variables
 discrete_octave_steps = True  # when True, induces clear separation of octaves within network
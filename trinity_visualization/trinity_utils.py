@@ -1,13 +1,14 @@
 import colorsys
-from itertools import combinations
+import gzip
+import hashlib
 import json
 import logging
+import os
 
 import numpy as np
-import pandas as pd
-import plotly.graph_objects as go
-from sklearn.manifold import MDS
 
+import parallel
+import pitches
 from . import trinity_config
 
 
@@ -35,7 +36,7 @@ def chord_color_mapping(chord):
 
 def distance_metric(chord1, chord2):
     """
-    Input: chordN = [A3 C3 E3] ...
+    Input: chordN = [57 48 52] (A3 C3 E3) ...
 
     Define a distance metric using the following ruleset:
         - Add 1 if the chord2 is an inversion of chord1
@@ -50,45 +51,215 @@ def distance_metric(chord1, chord2):
     distance = 0
 
     # Octave distance
+    octaves1 = [x // 12 - 1 for x in chord1]
+    octaves2 = [x // 12 - 1 for x in chord2]
     if trinity_config.discrete_octave_steps:
-        octave1 = max(set([x[-1] for x in chord1]), key=[x[-1] for x in chord1].count)
-        octave2 = max(set([x[-1] for x in chord2]), key=[x[-1] for x in chord2].count)
-        distance += abs(int(octave1) - int(octave2)) * trinity_config.octave_separation_coefficient
+        octave1 = max(sorted(set(octaves1)), key=octaves1.count)
+        octave2 = max(sorted(set(octaves2)), key=octaves2.count)
+        distance += abs(octave1 - octave2) * trinity_config.octave_separation_coefficient
     else:
-        octave1 = [float(x[-1]) for x in chord1]
-        octave1 = sum(octave1)/len(octave1)
-        octave2 = [float(x[-1]) for x in chord2]
-        octave2 = sum(octave2)/len(octave2)
+        octave1 = sum(octaves1)/len(octaves1)
+        octave2 = sum(octaves2)/len(octaves2)
         distance += abs(int(octave1) - int(octave2)) * trinity_config.octave_separation_coefficient
 
     # Root note distance
-    non_intersection = len(set([x[:-1] for x in chord1]) ^ set([x[:-1] for x in chord2]))
+    non_intersection = len(set([x % 12 for x in chord1]) ^ set([x % 12 for x in chord2]))
     distance += 1 + non_intersection * trinity_config.note_separation_coefficient
     return distance
 
 
+def chord_features(chords):
+    """
+    Encode a list of chords (note numbers, e.g. [[57 48 52], ...]) once as NumPy arrays for vectorized distance
+    computation:
+        - octave: modal octave (ties go to the lower octave) if discrete_octave_steps, else mean octave
+        - mask: pitch class bitmask, bit i standing for config.notes[i]
+        - identity: equal for chords with identical notes
+    """
+    notes, counts = pitches.pad(chords)
+    if trinity_config.discrete_octave_steps:
+        octaves = pitches.modal_octaves(notes).astype(float)
+    else:
+        octaves = pitches.mean_octaves(notes, counts)
+    masks = pitches.pitch_class_masks(notes).astype(np.uint16)
+    identity = np.unique(notes, axis=0, return_inverse=True)[1].reshape(-1) if len(chords) else np.zeros(0, np.int64)
+    return {"octave": np.trunc(octaves), "mask": masks, "identity": identity}
+
+
+def feature_distances(features1, features2):
+    """
+    Compute distance_metric between two sets of chord features (arrays from chord_features, broadcast together).
+    """
+    octave_distance = np.abs(features1["octave"] - features2["octave"])
+    non_intersection = np.bitwise_count(features1["mask"] ^ features2["mask"])
+    distances = octave_distance * trinity_config.octave_separation_coefficient
+    distances += 1 + non_intersection * trinity_config.note_separation_coefficient
+    distances[features1["identity"] == features2["identity"]] = 0
+    return distances
+
+
+def pairwise_distances(features, rows=slice(None), cols=slice(None)):
+    """
+    Compute distance_metric between the chords selected by rows and those selected by cols (all chords by default)
+    in one broadcast pass over the arrays from chord_features.
+    """
+    return feature_distances(
+        {key: values[rows, np.newaxis] for key, values in features.items()},
+        {key: values[np.newaxis, cols] for key, values in features.items()},
+    )
+
+
+def paired_distances(features, sources, targets):
+    """
+    Compute distance_metric between chords sources[k] and targets[k] for every k, e.g. along the edges of a graph.
+    """
+    return feature_distances(
+        {key: values[sources] for key, values in features.items()},
+        {key: values[targets] for key, values in features.items()},
+    )
+
+
+def top_eigenpairs(matrix, k):
+    """
+    Largest k eigenvalues (descending) and eigenvectors of a symmetric matrix. Uses Lanczos iteration, which only
+    needs matrix-vector products, falling back to a dense solver for tiny matrices.
+    """
+    from scipy.linalg import eigh
+    from scipy.sparse.linalg import eigsh
+
+    n = len(matrix)
+    if n <= k + 1:
+        eigenvalues, eigenvectors = eigh(matrix)
+        eigenvalues, eigenvectors = eigenvalues[-k:], eigenvectors[:, -k:]
+    else:
+        v0 = np.random.default_rng(0).standard_normal(n)  # fixed start vector, for reproducible layouts
+        eigenvalues, eigenvectors = eigsh(matrix, k=k, which="LA", v0=v0)
+    order = np.argsort(eigenvalues)[::-1]
+    return eigenvalues[order], eigenvectors[:, order]
+
+
+def classical_mds(distance_matrix, n_components=3):
+    """
+    Classical (Torgerson) multidimensional scaling: double-center the squared distances and project onto the top
+    eigenvectors. Works in place on distance_matrix.
+    """
+    # Double centering, B = -1/2 J D^2 J
+    b = distance_matrix
+    b **= 2
+    b -= b.mean(axis=0, keepdims=True)
+    b -= b.mean(axis=1, keepdims=True)
+    b *= -.5
+
+    # Project onto the top eigenvectors
+    eigenvalues, eigenvectors = top_eigenpairs(b, n_components)
+    vector_coordinates = np.zeros((len(b), n_components))
+    vector_coordinates[:, :len(eigenvalues)] = eigenvectors * np.sqrt(np.maximum(eigenvalues, 0))
+    return vector_coordinates
+
+
+def landmark_mds(features, n_landmarks=None, n_components=3, block_size=4096):
+    """
+    Landmark MDS (de Silva & Tenenbaum): embed a random subset of landmark chords with classical MDS, then place
+    every chord by triangulation from its distances to the landmarks. Only chord-to-landmark distances are ever
+    computed, one block of chords at a time, so memory is linear in the number of chords.
+    """
+    n = len(features["mask"])
+    n_landmarks = n_landmarks or trinity_config.embedding_landmarks
+    landmarks = np.sort(np.random.default_rng(0).choice(n, size=min(n_landmarks, n), replace=False))
+
+    # Classical MDS on the landmarks
+    landmark_distances = pairwise_distances(features, landmarks, landmarks) ** 2
+    mean_distances = landmark_distances.mean(axis=0)
+    b = landmark_distances - mean_distances
+    b -= b.mean(axis=1, keepdims=True)
+    b *= -.5
+    eigenvalues, eigenvectors = top_eigenpairs(b, n_components)
+    keep = eigenvalues > 1e-9
+    pseudoinverse = np.zeros((len(eigenvalues), len(landmarks)))
+    pseudoinverse[keep] = (eigenvectors[:, keep] / np.sqrt(eigenvalues[keep])).T
+
+    # Triangulate all chords from their squared distances to the landmarks
+    vector_coordinates = np.zeros((n, n_components))
+    for start in range(0, n, block_size):
+        rows = np.arange(start, min(start + block_size, n))
+        distances = pairwise_distances(features, rows, landmarks) ** 2
+        vector_coordinates[rows, :pseudoinverse.shape[0]] = -.5 * (distances - mean_distances) @ pseudoinverse.T
+    return vector_coordinates
+
+
+def embed(features, method, n_landmarks=None):
+    """
+    Convert chord features into 3D coordinates using an embedding method ("classical", "landmark" or "smacof"), with
+    n_landmarks landmarks for the landmark method (trinity_config.embedding_landmarks by default).
+    """
+    if method == "classical":
+        distances = parallel.build_distances(features)
+        if isinstance(distances, np.memmap):
+            # classical_mds overwrites its input, so keep the on-disk distances intact and work on a scratch copy
+            distances = parallel.scratch_copy(distances, "mds_scratch")
+        return classical_mds(distances)
+    if method == "landmark":
+        return landmark_mds(features, n_landmarks)
+    if method == "smacof":
+        from sklearn.manifold import MDS
+        mds = MDS(n_components=3, dissimilarity="precomputed", random_state=0)
+        return mds.fit_transform(parallel.build_distances(features))
+    raise ValueError(f"Unknown embedding method: {method}")
+
+
+def embedding_cache_key(enumerated_chords):
+    """
+    Fingerprint of everything the embedding depends on: the chord set and the distance/embedding settings.
+    """
+    settings = [
+        enumerated_chords,
+        trinity_config.embedding_method,
+        trinity_config.embedding_landmarks,
+        trinity_config.discrete_octave_steps,
+        trinity_config.octave_separation_coefficient,
+        trinity_config.note_separation_coefficient,
+    ]
+    return hashlib.sha256(json.dumps(settings).encode()).hexdigest()
+
+
 def generate_vector_space(chords):
     """
-    Takes in a list of chords. Uses the distance_metric function to produce pairwise distances between
-    each chord, then uses multidimensional scaling to convert pairwise distances into a 3D vector space
+    Takes in a list of chords. Encodes each chord once and derives pairwise distances following distance_metric,
+    then uses multidimensional scaling to convert pairwise distances into a 3D vector space. Coordinates are cached
+    on disk, so unchanged chords and settings skip the embedding entirely.
     """
     # Log progress
     logger.info("Generating a 3D vector space from input chords...")
-
-    # Retrieve pairwise distances
     enumerated_chords = [chord for sublist in list(chords.values()) for chord in sublist]
-    distance_matrix = np.zeros((len(enumerated_chords), len(enumerated_chords)))
-    for i in range(len(enumerated_chords)):
-        for j in range(len(enumerated_chords)):
-            chord1 = enumerated_chords[i]
-            chord2 = enumerated_chords[j]
-            distance_matrix[i, j] = distance_metric(chord1, chord2)
 
-    # Create vector space from pairwise distances using multidimensional scaling
-    mds = MDS(n_components=3, dissimilarity="precomputed", random_state=0)
-    vector_coordinates = mds.fit_transform(distance_matrix)
+    # Reuse cached coordinates if available
+    cache_file = None
+    vector_coordinates = None
+    if trinity_config.embedding_cache_dir:
+        cache_file = os.path.join(trinity_config.embedding_cache_dir, f"{embedding_cache_key(enumerated_chords)}.npy")
+        try:
+            vector_coordinates = np.load(cache_file)
+            logger.info(f"Loaded cached coordinates from {cache_file}")
+        except (OSError, ValueError, EOFError):
+            pass  # missing or unreadable, e.g. truncated: embed again
 
-    # Save vectors per chord
+    # Create vector space from pairwise distances using multidimensional scaling
+    if vector_coordinates is None:
+        vector_coordinates = embed(
+            chord_features(enumerated_chords), trinity_config.embedding_method, trinity_config.embedding_landmarks
+        )
+        if cache_file:
+            try:
+                os.makedirs(trinity_config.embedding_cache_dir, exist_ok=True)
+                # Write beside the cache file and swap it in, so an interrupted save never leaves a truncated file
+                with open(f"{cache_file}.tmp", "wb") as f:
+                    np.save(f, vector_coordinates)
+                os.replace(f"{cache_file}.tmp", cache_file)
+            except OSError as e:
+                logger.warning(f"Could not save coordinates cache: {e}")
+
+    # Save vectors per chord, with the modal octave (as in the exported labels, e.g. "3")
+    octaves = pitches.modal_octaves(pitches.pad(enumerated_chords)[0]).tolist()
     chords_with_vectors = []
     i = 0
     for chord_name in chords:
@@ -98,86 +269,133 @@ def generate_vector_space(chords):
                     "notes": chord,
                     "vector": vector_coordinates[i],
                     "chord_name": chord_name,
-                    "octave": max(set([x[-1] for x in chord]), key=[x[-1] for x in chord].count)
+                    "octave": str(octaves[i])
                 }
             )
             i += 1
     return chords_with_vectors, vector_coordinates
 
 
-def generate_trinity_graph(chords, note_frequencies, save_graph=trinity_config.trinity_graph):
+def generate_trinity_graph(chords, save_graph=trinity_config.trinity_graph,
+                           output_format=trinity_config.trinity_format):
     """
-    Save a graph as a JSON file, formatted specifically for visualization within the Trinity tool.
+    Save a graph as a JSON file, formatted specifically for visualization within the Trinity tool. Nodes and edges
+    are written to the file one at a time in compact form, gzip-compressed if the path ends in .gz, either as a
+    single JSON document or as NDJSON. Edges come from parallel.build_edges, the same computation that builds the
+    playback graph. Notes are exported by name, e.g. C#4. Returns the node colors, labels, octaves and edge index
+    pairs needed for the preview.
     """
     # Log progress
     logger.info("Generating and saving a Trinity graph object...")
 
     # Graph basics (hardcoded as Trinity input structure)
-    network =  {
+    header = {
         "messageType": "GraphDirectedCollection",
         "graphId": "I Need To Grow Away From These Roots",
         "defaultNodeColor": "#0000FF88",
         "defaultEdgeColor": "#FFFFFFFF",
-        "nodes": [],
-        "edges": []
     }
 
-    # Iterate through nodes, add to graph
-    i = 0
-    for chord_entry in chords:
-        node = {
-            "entityID": f"{i}",
-            "vector": chord_entry["vector"].tolist(),
-            "labels": [
+    # Edges from the shared note criteria, as in the playback graph (tiled across processes for huge vocabularies)
+    notes, _ = pitches.pad([chord_entry["notes"] for chord_entry in chords])
+    edges = parallel.build_edges(pitches.pitch_class_masks(notes).tolist(), "trinity")
+    network = {"colors": [], "labels": [], "octaves": [], "edges": np.asarray(edges, dtype=np.int64).reshape(-1, 2)}
+
+    # Records are written compactly, newline-delimited for NDJSON or comma-separated inside JSON lists
+    ndjson = output_format == "ndjson"
+    dumps = json.JSONEncoder(separators=(",", ":")).encode
+
+    def write_record(file, record, first):
+        if ndjson:
+            file.write(dumps(record) + "\n")
+        else:
+            file.write(("" if first else ",") + dumps(record))
+
+    opener = gzip.open if save_graph.endswith(".gz") else open
+    with opener(save_graph, "wt") as file:
+
+        # Header, then the opening of the node list
+        if ndjson:
+            file.write(dumps(header) + "\n")
+        else:
+            file.write(dumps(header)[:-1] + ',"nodes":[')
+
+        # Iterate through nodes, writing each as it is built
+        for i, chord_entry in enumerate(chords):
+            color = chord_color_mapping(chord_entry["chord_name"])
+            note_names = pitches.note_names(chord_entry["notes"])
+            labels = [
                 chord_entry["chord_name"],
-                f'{chord_entry["notes"]}',
+                f'{note_names}',
                 f'octave: {chord_entry["octave"]}'
-            ],
-            "color": chord_color_mapping(chord_entry["chord_name"]),
-            "properties": {
-                "chord": chord_entry["chord_name"],
-                "notes": chord_entry["notes"],
-                "frequencies": [note_frequencies[x] for x in chord_entry["notes"]],
-                "octave": chord_entry["octave"],
-            }
-        }
-        network["nodes"].append(node)
-        i += 1
-
-    # Iterate through edges
-    for chord1, chord2 in combinations(network["nodes"], 2):
-
-        chord1_roots = [x[:-1] for x in chord1["properties"]["notes"]]
-        chord2_roots = [x[:-1] for x in chord2["properties"]["notes"]]
-        non_intersection = set(chord1_roots) ^ set(chord2_roots)  # allow less stringent edge conditions?
-        if len(non_intersection) == 1:
-            edge = {
-                "startID": chord1["entityID"],
-                "endID": chord2["entityID"],
-                "color": "#88FFFFFF"
+            ]
+            node = {
+                "entityID": f"{i}",
+                "vector": chord_entry["vector"].tolist(),
+                "labels": labels,
+                "color": color,
+                "properties": {
+                    "chord": chord_entry["chord_name"],
+                    "notes": note_names,
+                    "frequencies": pitches.frequencies(chord_entry["notes"]).tolist(),
+                    "octave": chord_entry["octave"],
+                }
             }
-            network["edges"].append(edge)
-
-    # Save to file
-    with open(save_graph, "w") as file:
-        json.dump(network, file, indent=4)
+            network["colors"].append(color)
+            network["labels"].append(labels)
+            network["octaves"].append(chord_entry["octave"])
+            write_record(file, node, first=i == 0)
+
+        # Iterate through edges
+        if not ndjson:
+            file.write('],"edges":[')
+        for k, (start, end) in enumerate(edges):
+            write_record(file, {"startID": f"{start}", "endID": f"{end}", "color": "#88FFFFFF"}, first=k == 0)
+        if not ndjson:
+            file.write("]}")
 
     return network
 
 
-def render_graph(network, vector_coordinates):
+def edge_segments(vector_coordinates, edges):
+    """
+    Lay out edges as a single polyline: each edge's two endpoints followed by a NaN break, so that all edges can be
+    drawn by one trace.
+    """
+    segments = np.full((len(edges), 3, 3), np.nan)
+    segments[:, :2] = vector_coordinates[edges]
+    return segments.reshape(-1, 3)
+
+
+def render_graph(network, vector_coordinates, max_edges=trinity_config.preview_max_edges,
+                 octaves=trinity_config.preview_octaves, html_file=trinity_config.preview_html):
     """
-    Generate plotly graph.
+    Generate plotly graph. All edges are drawn as one WebGL line trace; for large networks the preview can be
+    limited to some octaves and a random subsample of edges, and written to a self-contained HTML file.
     """
+    import pandas as pd
+    import plotly.graph_objects as go
+
     # Log progress
     logger.info("Rendering plotly preview...")
 
+    # Select nodes (optionally by octave) and the edges between them
+    vector_coordinates = np.asarray(vector_coordinates)
+    edges = network["edges"]
+    visible = np.ones(len(vector_coordinates), dtype=bool)
+    if octaves is not None:
+        visible = np.isin(np.array(network["octaves"]), [str(octave) for octave in octaves])
+        edges = edges[visible[edges].all(axis=1)]
+    if max_edges is not None and len(edges) > max_edges:
+        logger.info(f"Subsampling {max_edges} of {len(edges)} edges for the preview")
+        edges = edges[np.sort(np.random.default_rng(0).choice(len(edges), size=max_edges, replace=False))]
+
     # Create a DataFrame with coordinates, labels, and colors
-    df = pd.DataFrame(vector_coordinates, columns=['x', 'y', 'z'])
+    df = pd.DataFrame(vector_coordinates[visible], columns=['x', 'y', 'z'])
 
     # Extract colors and labels for each node
-    colors = [node["color"] for node in network["nodes"]]
-    labels = ["\n ".join(node["labels"]) for node in network["nodes"]]  # Assuming single label
+    colors = [color for color, shown in zip(network["colors"], visible) if shown]
+    labels = ["\n ".join(node_labels) for node_labels, shown in zip(network["labels"], visible) if shown]
 
     # Initialize Plotly figure
     fig = go.Figure()
@@ -193,19 +411,16 @@ def render_graph(network, vector_coordinates):
         showlegend=False
     ))
 
-    # Add edges from network data
-    for edge in network["edges"]:
-        start = int(edge["startID"])
-        end = int(edge["endID"])
-        x0, y0, z0 = vector_coordinates[start]
-        x1, y1, z1 = vector_coordinates[end]
-        fig.add_trace(go.Scatter3d(
-            x=[x0, x1], y=[y0, y1], z=[z0, z1],
-            mode='lines',
-            line=dict(color='gray', width=1),
-            hoverinfo='none',
-            showlegend=False
-        ))
+    # Add edges from network data, as a single trace
+    segments = edge_segments(vector_coordinates, edges)
+    fig.add_trace(go.Scatter3d(
+        x=segments[:, 0], y=segments[:, 1], z=segments[:, 2],
+        mode='lines',
+        line=dict(color='gray', width=1),
+        connectgaps=False,
+        hoverinfo='none',
+        showlegend=False
+    ))
 
     # Layout adjustments
     fig.update_layout(
@@ -219,5 +434,9 @@ def render_graph(network, vector_coordinates):
         showlegend=False
     )
 
-    # Display graph
-    fig.show()
+    # Display graph, or save it for viewing later
+    if html_file:
+        fig.write_html(html_file, include_plotlyjs=True)
+        logger.info(f"Saved plotly preview to {html_file}")
+    else:
+        fig.show()
@@ -1,15 +1,12 @@
-from itertools import combinations
-import json
+from collections import OrderedDict
 import logging
 import random
-import time
 
-import networkx as nx
 import numpy as np
-import pickle
-import simpleaudio as sa
 
 import config
+import parallel
+import pitches
 
 
 # Set up logging infrastructure
@@ -19,57 +16,41 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-
-
-def load_chords():
-    """
-    Load chords from a file. If loading from a file fails, auto-generate chords list based on the config file.
-    """
-    try:
-        logger.info(f"Loading chords from {config.chords_file}...")
-        chords = json.load(open(config.chords_file, 'r'))
-    except Exception as e:
-        logger.warn(f"Could not open chords file: {e}")
-        logger.info("Proceeding with auto-generation of chords")
-        return get_chords()
-    return chords
-
-
-def load_graph(chords, frequencies):
-    """
-    Load chords graph from a file. If loading from a file fails, auto-generate graph list based on provided chords and
-    frequencies.
-    """
-    try:
-        logger.info(f"Loading graph from {config.graph_file}...")
-        with open(config.graph_file, 'rb') as f:
-            G = pickle.load(f)
-    except Exception as e:
-        logger.warn(f"Could not open graph file: {e}")
-        logger.info("Proceeding with auto-generation of graph")
-        return generate_graph(chords, frequencies)
-    return G
+# Rendered waveform cache (LRU, capped by memory) and shared fade envelopes
+wave_cache = OrderedDict()
+wave_cache_stats = {"hits": 0, "misses": 0, "bytes": 0}
+envelope_cache = {}
 
 
 def get_inversions(chord):
     """
-    Yield inversion combinations from a set of input notes. Octave jumps are indicated by "+"
+    Yield inversion combinations from a set of input pitch classes. Octave jumps are indicated by adding 12
 
-    Input: [C E G]
-    Output: [[C E G], [E+ G C], [G+ C+ E]]
+    Input: [C E G] = [0 4 7]
+    Output: [[0 4 7], [16 7 0], [19 12 4]] = [[C E G], [E+ G C], [G+ C+ E]]
     """
     inversions = []
     for i in range(len(chord)):
         inversion = chord[i:] + chord[:i]
-        inversion = [n + '+' if j < i else n for j, n in enumerate(inversion)]
+        inversion = [n + 12 if j < i else n for j, n in enumerate(inversion)]
         inversions.append(inversion)
     return inversions
 
 
-def get_chords(save_chords=config.generate_intermediate_files):
+def voice_chord(chord, octave):
     """
-    Produce a list of all possible chords in all possible inversions across all octaves specified in the config file.
-    Optionally save this list to a file.
+    Place an inversion in a given octave, as note numbers; notes marked with "+" go one octave up.
+
+    Input: [19 12 4] = [G+ C+ E], 3
+    Output: [67 60 52] = [G4 C4 E3]
+    """
+    return [(octave + 1) * 12 + note for note in chord]
+
+
+def get_chords():
+    """
+    Produce a list of all possible chords in all possible inversions across all octaves specified in the config file,
+    as note numbers.
     """
     # Log progress
     logger.info(f"Generating new chord set...")
@@ -79,51 +60,22 @@ def get_chords(save_chords=config.generate_intermediate_files):
     for root in config.notes:
         for chord_type, interval_pattern in config.intervals.items():
             chord_name = f"{root} {chord_type.replace('_', ' ')}"
-            chord = [(config.notes[(config.notes.index(root) + interval) % 12]) for interval in interval_pattern]
+            chord = [(config.notes.index(root) + interval) % 12 for interval in interval_pattern]
             inversions = get_inversions(chord)
             root_chords[chord_name] = inversions
 
     # Expand the list of chords to cover specific octaves
     all_chords = {}
     for chord_name, inversions in root_chords.items():
-        all_chords[chord_name] = []
-        for i, chord in enumerate(inversions):
-            for octave in range(config.lower_octave, config.upper_octave):
-                new_entry = []
-                for note in chord:
-                    if "+" in note:
-                        new_entry.append(note[:-1] + f"{octave + 1}")
-                    else:
-                        new_entry.append(note + f"{octave}")
-                all_chords[chord_name].append(new_entry)
-
-    # Optionally save the chords to a file for reuse
-    if save_chords:
-        try:
-            with open(config.chords_file, "w") as f:
-                json.dump(all_chords, f, indent=4)
-        except Exception as e:
-            logger.warn(f"Could not save chords file: {e}")
-            logger.info("Skipping...")
-            return get_chords()
-    return all_chords
+        all_chords[chord_name] = [
+            voice_chord(chord, octave) for chord in inversions
+            for octave in range(config.lower_octave, config.upper_octave)
+        ]
 
-
-def generate_frequencies():
-    """
-    Produce frequency mappings for each note.
-    """
-    note_frequencies = {}
-    for octave in range(config.lower_octave, config.upper_octave+1):
-        for i, note in enumerate(config.notes):
-            n = (octave - 4) * 12 + (i - 9)
-            frequency = config.A4_freq * (2 ** (n / 12))
-            note_name = f"{note}{octave}"
-            note_frequencies[note_name] = round(frequency, 2)
-    return note_frequencies
+    return all_chords
 
 
-def generate_graph(chords, note_frequencies, save_graph=config.generate_intermediate_files):
+def generate_graph(chords):
     """
     Produce a NetworkX graph in which nodes are chords, and edges are assigned to any two chords which share all but
     one note.
@@ -132,6 +84,7 @@ def generate_graph(chords, note_frequencies, save_graph=config.generate_intermed
     logger.info(f"Generating new chords graph...")
 
     # Create chord graph
+    import networkx as nx
     G = nx.Graph()
 
     # Generate chord labels
@@ -142,95 +95,153 @@ def generate_graph(chords, note_frequencies, save_graph=config.generate_intermed
                 f"chord_{i}",
                 chord=chord_name,
                 notes=chord,
-                frequencies=[note_frequencies[x] for x in chord]
+                frequencies=pitches.frequencies(chord).tolist()
             )
         i += 1
 
-    # Add edges based on the shared note criteria
-    for chord1, chord2 in combinations(G.nodes(), 2):
-        chord1_data = G.nodes[chord1]
-        chord2_data = G.nodes[chord2]
-        chord1_roots = [x[:-1] for x in chord1_data["notes"]]
-        chord2_roots = [x[:-1] for x in chord2_data["notes"]]
-        non_intersection = set(chord1_roots) ^ set(chord2_roots)  # allow less stringent edge conditions?
-        if len(non_intersection) == 1:
-            G.add_edge(chord1, chord2)
-
-    # Optionally save graph to a file for reuse
-    if save_graph:
-        try:
-            with open(config.graph_file, 'wb') as f:
-                pickle.dump(G, f)
-        except Exception as e:
-            logger.warn(f"Could not save graphs file: {e}")
-            logger.info("Skipping...")
+    # Add edges based on the shared note criteria (tiled across processes for huge vocabularies)
+    nodes = list(G.nodes())
+    masks = [pitches.pitch_class_mask(G.nodes[node]["notes"]) for node in nodes]
+    G.add_edges_from((nodes[i], nodes[j]) for i, j in parallel.build_edges(masks))
     return G
 
 
-def generate_chord_wave(frequencies, fade=config.fade, t=config.t, scaling_factor=1.0):
+def get_envelope(num_samples):
+    """
+    Return the fade in/out envelope for a waveform of a given length. Envelopes are shared between calls and must
+    not be modified.
+    """
+    envelope = envelope_cache.get(num_samples)
+    if envelope is None:
+        envelope = np.ones(num_samples, dtype=np.float32)
+        attack_samples = min(int(config.attack_time * config.sample_rate), num_samples // 2)
+        release_samples = min(int(config.release_time * config.sample_rate), num_samples // 2)
+        envelope[:attack_samples] = np.linspace(0, 1, attack_samples)
+        envelope[-release_samples:] = np.linspace(1, 0, release_samples)
+        envelope.flags.writeable = False
+        envelope_cache[num_samples] = envelope
+    return envelope
+
+
+def synthesize_partials(frequencies, t, block_size=config.synthesis_block_size):
+    """
+    Render the sum of sine waves at the given frequencies over time axis t as a float32 array. All partials are
+    evaluated together by broadcasting frequencies against t, one block of samples at a time to bound temporary
+    memory. Phases are wrapped to a single cycle in float64 before the float32 sine, so long durations keep their
+    precision.
+    """
+    frequencies = np.asarray(frequencies, dtype=np.float64)[:, np.newaxis]
+    chord_wave = np.empty(len(t), dtype=np.float32)
+    for start in range(0, len(t), block_size):
+        end = min(start + block_size, len(t))
+        phase = frequencies * t[start:end]  # cycles elapsed, one row per partial
+        phase -= np.floor(phase)
+        partials = phase.astype(np.float32)
+        partials *= 2 * np.pi
+        np.sin(partials, out=partials)
+        partials.sum(axis=0, out=chord_wave[start:end])
+    return chord_wave
+
+
+def generate_chord_wave(frequencies, fade=config.fade, t=None, scaling_factor=1.0):
     """
-    Generate a waveform as a numpy array for a given set of frequencies..
+    Generate a waveform as a numpy array for a given set of frequencies, over time axis t (config.t by default).
+    Rendered waveforms are kept in a memory-capped LRU cache, so revisited chords and notes cost no synthesis.
+    Returned arrays are read-only.
     """
-    # Generate sine waves for each frequency in the chord
-    waves = [0.5 * np.sin(2 * np.pi * freq * t) for freq in frequencies]
-    chord_wave = sum(waves)
+    if t is None:
+        t = config.t
+
+    # Return a previously rendered waveform if there is one
+    key = (tuple(frequencies), len(t), float(t[-1]) if len(t) else 0.0, fade, scaling_factor)
+    chord_wave = wave_cache.get(key)
+    if chord_wave is not None:
+        wave_cache.move_to_end(key)
+        wave_cache_stats["hits"] += 1
+        return chord_wave
+    wave_cache_stats["misses"] += 1
+
+    # Sum sine waves for each frequency in the chord
+    chord_wave = synthesize_partials(frequencies, t)
 
     # Fade in and out effect
     if fade:
-        envelope = np.ones_like(t)
-        attack_samples = min(int(config.attack_time * config.sample_rate), len(t) // 2)
-        release_samples = min(int(config.release_time * config.sample_rate), len(t) // 2)
-        envelope[:attack_samples] = np.linspace(0, 1, attack_samples)
-        envelope[-release_samples:] = np.linspace(1, 0, release_samples)
-        chord_wave = chord_wave * envelope  # apply fade
+        chord_wave *= get_envelope(len(t))  # apply fade
 
     # Normalize to 16-bit range
-    chord_wave = (chord_wave * scaling_factor * (2**15 - 1) / np.max(np.abs(chord_wave))).astype(np.int16)
+    peak = max(chord_wave.max(), -chord_wave.min())
+    chord_wave *= scaling_factor * (2**15 - 1) / peak
+    chord_wave = chord_wave.astype(np.int16)
+
+    # Cache, evicting least recently used waveforms beyond the memory cap
+    chord_wave.flags.writeable = False
+    wave_cache[key] = chord_wave
+    wave_cache_stats["bytes"] += chord_wave.nbytes
+    while wave_cache_stats["bytes"] > config.wave_cache_bytes and len(wave_cache) > 1:
+        _, evicted = wave_cache.popitem(last=False)
+        wave_cache_stats["bytes"] -= evicted.nbytes
     return chord_wave
 
 
-def play_base_chord(G, node):
+def log_wave_cache_stats():
     """
-    Generate waveform for a chord, retrieved from a given node in the chords graph.
+    Report waveform cache hit rate and memory use.
     """
-    inv = generate_chord_wave(G.nodes[node]["frequencies"])
-    play_obj = sa.play_buffer(inv, 1, 2, 44100)
-    play_obj.wait_done()
+    lookups = wave_cache_stats["hits"] + wave_cache_stats["misses"]
+    hit_rate = wave_cache_stats["hits"] / lookups if lookups else 0.0
+    logger.info(
+        f"Waveform cache: {hit_rate:.1%} hit rate over {lookups} lookups, {len(wave_cache)} buffers, "
+        f"{wave_cache_stats['bytes'] / 2**20:.1f} MiB"
+    )
 
 
-def play_supplement(G, current_node, duration=config.duration):
+def plan_supplement(frequencies, duration=config.duration, rng=random):
     """
-    Play a single note to supplement the base chord. Duration, pitch, repetition subject to variables in the
-    config file.
+    Plan the supplemental note line for a chord as a list of (offset, frequency, samples, repetition) events, with
+    offsets and lengths in samples: an initial pause, then notes (repeated if short) separated by random pauses, all
+    within the config bounds, until the chord's duration is used up.
     """
+    events = []
+    total_samples = int(duration * config.sample_rate)
+
     # Initial pause to allow base chord to sound
-    start_time = time.time()
-    wait_time = random.uniform(config.pause_lower_bound, config.pause_upper_bound)
-    if wait_time > duration - (time.time() - start_time):
-        return
-    time.sleep(wait_time)
+    elapsed = int(rng.uniform(config.pause_lower_bound, config.pause_upper_bound) * config.sample_rate)
+    if elapsed > total_samples:
+        return events
 
-    while time.time() - start_time < duration:
+    while elapsed < total_samples:
 
-        # Create a waveform envelope, set repetition depending on waveform length
-        ttl = random.uniform(config.lower_length_supplemental, config.upper_length_supplemental)
-        repetition = 1 if ttl > config.repetition_length_threshold else random.randint(
+        # Note length, repetition and pitch
+        ttl = rng.uniform(config.lower_length_supplemental, config.upper_length_supplemental)
+        repetition = 1 if ttl > config.repetition_length_threshold else rng.randint(
             config.lower_repetition_bound, config.upper_repetition_bound
         )
-        ttl = np.linspace(0, ttl, int(config.sample_rate * ttl), False)
-
-        # Generate the note
-        octave = random.randrange(config.lower_octave_supplemental, config.upper_octave_supplemental)
-        note = random.choice(G.nodes[current_node]["frequencies"]) * (2 ** octave)
-        note = generate_chord_wave([note], t=ttl, fade=True, scaling_factor=config.scaling_factor)
-
-        # Repeat waveform according to repetition threshold
-        for i in range(repetition):
-            play_obj = sa.play_buffer(note, 1, 2, config.sample_rate)
-            play_obj.wait_done()
+        ttl = max(round(ttl / config.supplemental_length_step), 1) * config.supplemental_length_step
+        samples = int(config.sample_rate * ttl)
+        octave = rng.randrange(config.lower_octave_supplemental, config.upper_octave_supplemental)
+        frequency = rng.choice(frequencies) * (2 ** octave)
+        events.append((elapsed, frequency, samples, repetition))
+        elapsed += samples * repetition
 
         # Pause for a random amount of time
-        wait_time = random.uniform(config.pause_lower_bound, config.pause_upper_bound)
-        if wait_time > duration - (time.time() - start_time):
-            return
-        time.sleep(wait_time)
+        wait_samples = int(rng.uniform(config.pause_lower_bound, config.pause_upper_bound) * config.sample_rate)
+        if wait_samples > total_samples - elapsed:
+            return events
+        elapsed += wait_samples
+    return events
+
+
+def render_supplement(frequencies, duration=config.duration, rng=random):
+    """
+    Render the supplemental note line for a chord into one int16 buffer, aligned with the start of the base chord:
+    events from plan_supplement are placed at their sample offsets, each repeated note tiled end to end. Notes share
+    the default time axis. The buffer spans the chord's duration, or longer if the last note rings past it.
+    """
+    events = plan_supplement(frequencies, duration, rng)
+    end = max((offset + samples * repetition for offset, _, samples, repetition in events), default=0)
+    supplement = np.zeros(max(int(duration * config.sample_rate), end), dtype=np.int16)
+    for offset, frequency, samples, repetition in events:
+        t = config.t[:samples] if samples <= len(config.t) else np.arange(samples) / config.sample_rate
+        note = generate_chord_wave([frequency], t=t, fade=True, scaling_factor=config.scaling_factor)
+        supplement[offset:offset + samples * repetition] = np.tile(note, repetition)
+    return supplement